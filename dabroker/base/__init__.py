@@ -13,6 +13,8 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 ##BP
 
 from six import string_types,integer_types
+from operator import attrgetter
+from zlib import crc32
 
 class UnknownCommandError(Exception):
 	def __init__(self, cmd):
@@ -143,6 +145,7 @@ class common_BaseRef(object):
 	"""Common base for reference coding; the decoder is overridden in client and server"""
 	cls = BaseRef
 	clsname = "Ref"
+	immutable = True
 	
 	@classmethod
 	def encode(cls,ref, include=False, meta=None):
@@ -195,6 +198,15 @@ class common_BaseObj(object):
 			r[k] = cls.encode_ref(obj,k)
 		return res
 
+def _tuple_getter(names):
+	"""Like attrgetter(), but always returns a tuple."""
+	if not names:
+		return lambda obj: ()
+	if len(names) == 1:
+		get = attrgetter(names[0])
+		return lambda obj: (get(obj),)
+	return attrgetter(*names)
+
 class BrokeredInfo(BaseObj):
 	"""\
 		This class is used for metadata about Brokered objects.
@@ -210,6 +222,8 @@ class BrokeredInfo(BaseObj):
 	name = None
 	_meta = None
 	cached = None
+	_encoder = None
+	_layout = None
 
 	def __init__(self,name=None, **k):
 		super(BrokeredInfo,self).__init__(**k)
@@ -244,6 +258,64 @@ class BrokeredInfo(BaseObj):
 			self.calls[f.name] = f
 		else:
 			raise RuntimeError("I don't know how to add this")
+		self._encoder = None
+		self._layout = None
+
+	def obj_encoder(self, compact=False):
+		"""\
+			Return a function which returns an object's field and ref
+			dicts, as required by common_BaseObj.encode.
+
+			If @compact is set, the function returns a list instead:
+			the layout checksum, then the field values, then the ref
+			keys, in `layout()` order.
+
+			The function is built once, for the current field list; adding
+			a field discards it.
+			"""
+		enc = self._encoder
+		if enc is None:
+			self._encoder = enc = self._build_encoder()
+		return enc[compact]
+
+	def layout(self):
+		"""\
+			Return the field names and ref names (without `_meta`) in
+			the order used by the compact object encoding, plus a
+			checksum of both lists.
+
+			The client uses the checksum to verify that it uses the same
+			layout as the server.
+			"""
+		res = self._layout
+		if res is None:
+			fields = tuple(sorted(self.fields.keys()))
+			refs = tuple(sorted(k for k in self.refs.keys() if k != '_meta'))
+			sig = crc32('\0'.join(fields+('',)+refs).encode('utf-8')) & 0xffffffff
+			self._layout = res = (fields,refs,sig)
+		return res
+
+	def _build_encoder(self):
+		fields = tuple(self.fields.keys())
+		refs = tuple(self.refs.keys())
+		f_get = _tuple_getter(fields)
+		r_get = _tuple_getter(refs)
+
+		def encode(obj):
+			f = dict(zip(fields, f_get(obj)))
+			r = dict(zip(refs, (None if v is None else v._key for v in r_get(obj))))
+			return f,r
+
+		c_fields,c_refs,sig = self.layout()
+		cf_get = _tuple_getter(c_fields)
+		cr_get = _tuple_getter(c_refs)
+
+		def encode_compact(obj):
+			res = [sig]
+			res.extend(cf_get(obj))
+			res.extend(None if v is None else v._key for v in cr_get(obj))
+			return res
+		return encode,encode_compact
 
 	def obj_find(self, _limit=None, **kw):
 		raise NotImplementedError("Searching these objects is not implemented.")
@@ -290,7 +362,10 @@ class BackRef(_Attribute):
 class Callable(_Attribute):
 	"""A procedure that will be called on the server.
 		The 'for_class' attribute, if true, says that this is a classmethod:
-		True=yes, None/missing=No, False=it's a staticmethod."""
+		True=yes, None/missing=No, False=it's a staticmethod.
+		If 'cached' is set, clients cache the result until the object changes.
+		'ttl' limits that to this many seconds; a result is then returned
+		for another 'stale' seconds while the client fetches a new one."""
 	pass
 
 adapters = []
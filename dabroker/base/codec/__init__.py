@@ -13,11 +13,13 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 ##BP
 
 import sys
+import zlib
 from time import mktime
 from ...util import TZ,UTC, format_dt,pformat
 from ..config import default_config
 from .. import NoData,ManyData
 import datetime as dt
+from array import array
 from collections import namedtuple
 from dabroker.util import attrdict,pformat
 
@@ -27,6 +29,24 @@ logger = logging.getLogger("dabroker.base.codec")
 
 class _notGiven: pass
 class ComplexObjectError(Exception): pass
+class _SharedObject(Exception): pass
+
+WireMessage = namedtuple('WireMessage',('body','buffers','encoding'))
+# A serialized message, plus its out-of-band buffers, plus the name of
+# the compression method used on the body (or None).
+# Codecs return this instead of a plain serialized message when there is
+# binary data which is too large to be copied around, or when the
+# message is compressed. Transports which can't carry this type directly
+# need to frame it; see dabroker.base.transport.amqp for an example.
+
+compressors = {}
+def register_compressor(name, compress,decompress):
+	"""\
+		Add a compression method. @compress and @decompress are
+		functions which accept and return a byte string.
+		"""
+	compressors[name] = (compress,decompress)
+register_compressor("zlib", zlib.compress,zlib.decompress)
 
 DecodeRef = namedtuple('DecodeRef',('oid','parent','offset', 'cache'))
 # This is used to store references to to-be-amended objects.
@@ -39,19 +59,86 @@ DecodeRef = namedtuple('DecodeRef',('oid','parent','offset', 'cache'))
 # references, to be evaluated later (when an attribute referring to the
 # object is accessed).
 
+class LazyValue(object):
+	"""\
+		A value which has not been decoded yet. See BaseCodec.
+
+		It keeps the message's object cache alive until it's decoded.
+		Decoding consumes the wire data, so the result replaces it.
+		"""
+	__slots__ = ('data','ctx')
+
+	def __init__(self, data, ctx):
+		self.data = data
+		self.ctx = ctx
+
+	def get(self):
+		"""Decode the value."""
+		if self.ctx is None:
+			return self.data
+		codec,objcache,buffers,shapes = self.ctx
+		objtodo = []
+		res = codec._decode(self.data, objcache,objtodo, buffers,shapes)
+		codec._cleanup(objcache,objtodo)
+		if isinstance(res,DecodeRef):
+			res = objcache[res.oid]
+		self.data = res
+		self.ctx = None
+		return res
+
+	def __repr__(self):
+		return "{}({!r})".format(self.__class__.__name__,self.data)
+
 class SupD(dict):
-	"""A dictionary which finds classes"""
+	"""\
+		A dictionary which finds classes.
+
+		Lookups are remembered per type, so that finding the adapter for
+		a type which has been seen before costs a single dict probe.
+		Adding an entry clears that cache. @hits and @misses count how
+		often it was (not) used.
+		"""
+	def __init__(self,*a,**k):
+		super(SupD,self).__init__(*a,**k)
+		self._cache = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __setitem__(self,k,v):
+		super(SupD,self).__setitem__(k,v)
+		self._cache.clear()
+
 	def get(self,k,default=_notGiven):
 		"""Look up type K according to the name of its class, or its closest constituent"""
+		try:
+			res = self._cache[k]
+		except (KeyError,TypeError):
+			self.misses += 1
+			res = self._lookup(k)
+			try:
+				self._cache[k] = res
+			except TypeError: # not hashable
+				pass
+		else:
+			self.hits += 1
+		if res is _notGiven:
+			if default is _notGiven:
+				raise KeyError(k)
+			return default
+		return res
+
+	def _lookup(self,k):
 		if hasattr(k,"__mro__"):
 			for x in k.__mro__:
 				try:
 					return self.__getitem__(x.__module__+"."+x.__name__)
 				except KeyError:
 					pass
-		if default is _notGiven:
-			raise KeyError(k)
-		return default
+		return _notGiven
+
+	def stats(self):
+		"""Report cache usage"""
+		return dict(hits=self.hits, misses=self.misses, size=len(self._cache))
 
 _basics = []
 def codec_adapter(cls):
@@ -59,10 +146,38 @@ def codec_adapter(cls):
 	_basics.append(cls)
 	return cls
 
+# Integer forms of temporal values, used by the compact adapters below
+# and by binary serializers.
+
+def datetime_to_us(obj):
+	"""Microseconds since the epoch (same reference point as _datetime)"""
+	return int(mktime(obj.timetuple()))*1000000 + obj.microsecond
+
+def us_to_datetime(t):
+	s,us = divmod(t,1000000)
+	return dt.datetime.utcfromtimestamp(s).replace(microsecond=us,tzinfo=UTC).astimezone(TZ)
+
+def time_to_us(obj):
+	"""Microseconds since midnight"""
+	return ((obj.hour*60+obj.minute)*60+obj.second)*1000000 + obj.microsecond
+
+def us_to_time(t):
+	t,us = divmod(t,1000000)
+	t,s = divmod(t,60)
+	h,m = divmod(t,60)
+	return dt.time(h,m,s,us)
+
+def timedelta_to_us(obj):
+	return (obj.days*86400+obj.seconds)*1000000 + obj.microseconds
+
+def us_to_timedelta(t):
+	return dt.timedelta(microseconds=t)
+
 @codec_adapter
 class _datetime(object):
 	cls = dt.datetime
 	clsname = "datetime"
+	immutable = True
 
 	@staticmethod
 	def encode(obj, include=False):
@@ -70,7 +185,9 @@ class _datetime(object):
 		return {"t":mktime(obj.timetuple()),"s":format_dt(obj)}
 
 	@staticmethod
-	def decode(t=None,s=None,a=None,k=None,**_):
+	def decode(t=None,s=None,a=None,k=None,u=None,**_):
+		if u is not None:
+			return us_to_datetime(u)
 		if t:
 			return dt.datetime.utcfromtimestamp(t).replace(tzinfo=UTC).astimezone(TZ)
 		else: ## historic
@@ -81,6 +198,7 @@ class _datetime(object):
 class _timedelta(object):
 	cls = dt.timedelta
 	clsname = "timedelta"
+	immutable = True
 
 	@staticmethod
 	def encode(obj, include=False):
@@ -88,13 +206,16 @@ class _timedelta(object):
 		return {"t":obj.total_seconds(),"s":str(obj)}
 
 	@staticmethod
-	def decode(t,s=None,**_):
+	def decode(t=None,s=None,u=None,**_):
+		if u is not None:
+			return us_to_timedelta(u)
 		return dt.timedelta(0,t)
 
 @codec_adapter
 class _date(object):
 	cls = dt.date
 	clsname = "date"
+	immutable = True
 
 	@staticmethod
 	def encode(obj, include=False):
@@ -111,6 +232,7 @@ class _date(object):
 class _time(object):
 	cls = dt.time
 	clsname = "time"
+	immutable = True
 
 	@staticmethod
 	def encode(obj, include=False):
@@ -119,11 +241,87 @@ class _time(object):
 		return {"t":secs,"s":"%02d:%02d:%02d" % (ou.hour,ou.minute,ou.second)}
 
 	@staticmethod
-	def decode(t=None,s=None,a=None,k=None,**_):
+	def decode(t=None,s=None,a=None,k=None,u=None,**_):
+		if u is not None:
+			return us_to_time(u)
 		if t:
 			return dt.datetime.utcfromtimestamp(t).time()
 		return dt.time(*a)
 
+# Without the human-readable strings. Registered if `codec_compact_dates`
+# is set; the decoders above understand both forms.
+_compact_dates = []
+
+class _compact_datetime(_datetime):
+	@staticmethod
+	def encode(obj, include=False):
+		return {"u":datetime_to_us(obj)}
+_compact_dates.append(_compact_datetime)
+
+class _compact_timedelta(_timedelta):
+	@staticmethod
+	def encode(obj, include=False):
+		return {"u":timedelta_to_us(obj)}
+_compact_dates.append(_compact_timedelta)
+
+class _compact_date(_date):
+	@staticmethod
+	def encode(obj, include=False):
+		return {"d":obj.toordinal()}
+_compact_dates.append(_compact_date)
+
+class _compact_time(_time):
+	@staticmethod
+	def encode(obj, include=False):
+		return {"u":time_to_us(obj)}
+_compact_dates.append(_compact_time)
+
+# Python 2 has no 64-bit typecode, but its 'l' is 64 bits on most systems.
+try:
+	array(str('q'))
+except ValueError:
+	_array_types = {'q':str('l'), 'Q':str('L')}
+else:
+	_array_types = {}
+
+def array_type(t):
+	"""Return a typecode for array() which corresponds to @t."""
+	return _array_types.get(t,str(t))
+
+def array_to_bytes(arr):
+	"""Convert an array to (little-endian) bytes."""
+	if sys.byteorder != 'little':
+		arr = array(arr.typecode,arr)
+		arr.byteswap()
+	return arr.tobytes() if hasattr(arr,'tobytes') else arr.tostring()
+
+def array_from_bytes(t,data):
+	"""Convert (little-endian) bytes to an array."""
+	res = array(array_type(t))
+	if hasattr(res,'frombytes'):
+		res.frombytes(data)
+	else:
+		res.fromstring(bytes(data))
+	if sys.byteorder != 'little':
+		res.byteswap()
+	return res
+
+@codec_adapter
+class _array(object):
+	cls = array
+	clsname = "array"
+
+	@staticmethod
+	def encode(obj, include=False):
+		return {"t":obj.typecode, "d":obj.tolist()}
+
+	@staticmethod
+	def decode(t,d=None,b=None,**_):
+		if b is not None:
+			# packed by the serializer
+			return array_from_bytes(t,b)
+		return array(array_type(t),d)
+
 @codec_adapter
 class _attrdict(object):
 	cls = attrdict
@@ -197,9 +395,10 @@ class _exc(object):
 		return err
 
 scalar_types = {type(None),float,bytes}
-from six import string_types,integer_types
+from six import string_types,integer_types,text_type
 for s in string_types+integer_types: scalar_types.add(s)
 scalar_types = tuple(scalar_types)
+buffer_types = (bytes,bytearray,memoryview)
 
 class BaseCodec(object):
 	"""\
@@ -211,16 +410,62 @@ class BaseCodec(object):
 
 		@adapters is a list of additional adapters which are to be
 		registered.
+
+		Subclasses may set
+		@native_types: types which the serializer can handle itself.
+		               They are passed through unchanged, like strings.
+		@packers: adapter name => function which converts the adapter's
+		          output to something more compact. The serializer is
+		          responsible for turning that back into a dict.
+
+		Binary data (bytes, bytearray, memoryview) of at least
+		`codec_oob_min` bytes is not embedded in the message. It is
+		passed out-of-band instead, in the message's `buffers` list.
+
+		Serialized messages of at least `codec_compress_min` bytes are
+		compressed with `codec_compress` (see `register_compressor`), if set.
+
+		If `codec_intern` is set, dicts which share their type name and
+		keys are sent as value lists. The names are sent once, in the
+		message's `shapes` table.
+
+		If `codec_compact_dates` is set, dates and times are sent as plain
+		integers, without a human-readable string.
+
+		Adapters of immutable values (references, dates) set their
+		`immutable` attribute. The encoder doesn't check whether these are
+		shared, so they don't prevent the fast path for tree-shaped data.
+
+		If `codec_lazy` is set, adapters may list keys in their `lazy`
+		attribute. Non-scalar values within these keys' values are not
+		decoded; they're passed to the adapter as LazyValue objects.
 		"""
+	native_types = ()
+	packers = {}
+	defaults = dict(codec_oob_min=65536, codec_compress=None, codec_compress_min=1024, codec_compact=False, codec_intern=False, codec_lazy=False, codec_compact_dates=False)
 
 	def __init__(self,loader,adapters=(), cfg={}):
 		super(BaseCodec,self).__init__()
 		self.loader = loader
 		self.cfg = default_config.copy()
+		self.cfg.update(self.defaults)
 		self.cfg.update(cfg)
+		self.scalar_types = scalar_types + tuple(self.native_types)
+		# bytes need to be checked for size
+		self.oob_scalar_types = tuple(t for t in self.scalar_types if t is not bytes)
+		self.oob_min = self.cfg['codec_oob_min']
+		self.intern = self.cfg['codec_intern']
+		self.lazy = self.cfg['codec_lazy']
+		self.lazy_keys = {} # decoder: name => keys
+		self.compress = self.cfg['codec_compress']
+		if self.compress is not None:
+			self._compress = compressors[self.compress][0]
+			self.compress_min = self.cfg['codec_compress_min']
 		self.type2cls = SupD() # encoder
 		self.name2cls = {} # decoder 
 		self.register(_basics)
+		if self.cfg['codec_compact_dates']:
+			self.register(_compact_dates)
 		self.register(adapters)
 	
 	def register(self,cls):
@@ -235,15 +480,33 @@ class BaseCodec(object):
 			self.type2cls[cls.cls.__module__+"."+cls.cls.__name__] = cls
 		if cls.clsname is not None:
 			self.name2cls[cls.clsname] = cls
+			lazy = getattr(cls,'lazy',None)
+			if lazy:
+				self.lazy_keys[cls.clsname] = set(lazy)
+			else:
+				self.lazy_keys.pop(cls.clsname,None)
 		
-	def _encode(self, data, objcache,objref, include=False, p=None,off=None):
-		# @objcache: dict: id(obj) => (seqnum,encoded,selfref)
+	def _encode(self, data, objcache,objref, include=False, buffers=None, shaped=None):
+		# @objcache: dict: id(obj) => [seqnum,encoded,selfref,obj]
 		#            `encoded` will be set to the encoded object so that
 		#            the seqnum can be removed later if it turns out not to
 		#            be needed.
+		#            `selfref` is None while the object is being encoded,
+		#            False if it turned out to be part of a recursive
+		#            structure, or (completion_seq,parent,offset) otherwise.
 		# 
 		# @objref: dict: seqnum => oid: objects which are actually required for proper
-		#          encoding. If `None`, try to do simple encoding.
+		#          encoding. If `None`, try to do simple encoding: @objcache
+		#          then only maps id(obj) => obj, and _SharedObject is raised
+		#          as soon as an object is seen a second time. Objects whose
+		#          adapter is `immutable` (and their content) are not
+		#          recorded; they're simply encoded again.
+		#
+		# @buffers: list which collects out-of-band data. If `None`,
+		#           binary data is always included in the message.
+		#
+		# @shaped: list which collects the encoded dicts and their type
+		#          names, for _intern().
 		
 		# Scalars (integers, strings) do not refer to other objects and
 		# thus are never encoded.
@@ -252,90 +515,181 @@ class BaseCodec(object):
 		# referred to multiple times from the same object tree. This is too
 		# unlikely to be worth the bother.
 
-		# Numbers and strings are never encoded by this
-		if isinstance(data,scalar_types):
-			return data
-
-		# If this is a Werkzeug localproxy, dereference it
-		# before doing anything else
-		ac = getattr(data,'_get_current_object',None)
-		if ac is not None:
-			data = ac()
-
-		# Have I seen that before?
-		did = id(data)
-		oid = objcache.get(did,None)
-		if oid is not None:
-			# Yes.
-			if oid[1] is None: # it's incomplete: mark as recursive structure.
-				oid[2] = False
-
-			# Point to it.
-			oid = oid[0]
-			objref[oid] = did
-			return {'_or':oid}
-
-		# No, this is a new object: Generate a new ID for it.
-		# (There's other stuff in objcache, but that's harmless.)
-		oid = 1+len(objcache)
-		objcache[did] = [oid,None,None,data]
-		# we need to keep the data around.
-		# Otherwise the address may get reused (data gets dynamically build
-		# by encoding objects), so we get very interesting data corruption effects.
-		
-		if isinstance(data,(list,tuple)):
-			# A list will keep its "include" state
-			res = []
-			i = 0
-			for x in data:
-				res.append(self._encode(x,objcache,objref,include, p=res,off=i))
-				i += 1
-
-			res = { '_o':'LIST','_d':res }
-
+		# This code does not recurse. Instead, it keeps a stack of
+		# containers whose encoding is in progress. A frame is a list:
+		#   [iterator, result, include, is_dict, objcache entry, encoded object, type name, parent, offset, untracked]
+		# `result` is the list or dict which receives the encoded values.
+		# Usually it's the same as `encoded object`, except for lists
+		# which need a wrapper.
+		# A container is stored in its parent as soon as it's started, so
+		# that it ends up at the correct position.
+		#
+		# The top level is a fake single-element list.
+		type2cls = self.type2cls
+		packers = self.packers
+		if buffers is None:
+			scalar_types = self.scalar_types
 		else:
-			odata = data
-			inc = 2
-			# Marker to use the field key: include 'f' values (data fields)
-
-			if type(data) is not dict:
-				obj = self.type2cls.get(type(data),None)
+			scalar_types = self.oob_scalar_types
+			oob_min = self.oob_min
+		simple = objref is None
+		done = objcache.get('done',1)
+		top = []
+		stack = [[iter((data,)), top, include, False, None,None,None, None,None, False]]
+		while stack:
+			fr = stack[-1]
+			r = fr[1]
+			inc = fr[2]
+
+			# Step 1: copy scalars until we find something more complicated
+			if fr[3]:
+				for k,v in fr[0]:
+					# Transparent encoding: _ofoo => _o_foo, undone in the decoder
+					# so that our _o and _oi values don't clash with whatever
+					if k.startswith('_o'):
+						k = '_o_'+k[2:]
+
+					# Numbers and strings are never encoded by this
+					if isinstance(v,scalar_types):
+						r[k] = v
+						continue
+
+					# inc==2: include regular data values, but not refs or whatever
+					if inc == 2:
+						inc = (k == "f")
+					break
+				else:
+					k = None
+			else:
+				# A list will keep its "include" state
+				for v in fr[0]:
+					if isinstance(v,scalar_types):
+						r.append(v)
+						continue
+					k = len(r)
+					r.append(None)
+					break
+				else:
+					k = None
+
+			if k is None:
+				# Step 2a: This container is complete.
+				stack.pop()
+				res = fr[5]
+				if shaped is not None and fr[3]:
+					# _intern() adds the type name
+					shaped.append((res,fr[6]))
+				elif fr[6] is not None:
+					res['_o'] = fr[6]
+				entry = fr[4]
+				if entry is None: # top level, or simple encoding
+					continue
+				entry[1] = res
+				if entry[2] is None:
+					# order non-recursive objects by completion time.
+					entry[2] = (done,fr[7],fr[8])
+					done += 1
+				continue
+
+			# Step 2b: Process a non-scalar value.
+			t = type(v)
+
+			# Large binary data is passed out-of-band.
+			if t in buffer_types:
+				if buffers is not None and len(v) >= oob_min:
+					r[k] = {'_o':'BUF','i':len(buffers)}
+					buffers.append(v)
+				elif t is bytes:
+					r[k] = v
+				elif t is memoryview:
+					r[k] = v.tobytes()
+				else:
+					r[k] = bytes(v)
+				continue
+
+			# If this is a Werkzeug localproxy, dereference it
+			# before doing anything else
+			if t is not dict and t is not list:
+				ac = getattr(v,'_get_current_object',None)
+				if ac is not None:
+					v = ac()
+					t = type(v)
+
+			# Have I seen that before?
+			did = id(v)
+			oid = objcache.get(did,None)
+			if oid is not None:
+				# Yes.
+				if simple:
+					raise _SharedObject
+				if oid[1] is None: # it's incomplete: mark as recursive structure.
+					oid[2] = False
+
+				# Point to it.
+				oid = oid[0]
+				objref[oid] = did
+				r[k] = {'_or':oid}
+				continue
+
+			# No, this is a new object.
+			untracked = fr[9]
+			if t is list or t is tuple or isinstance(v,(list,tuple)):
+				obj = 'LIST'
+				ov = v
+			elif t is not dict:
+				obj = type2cls.get(t,None)
 				if obj is None:
-					raise NotImplementedError("I don't know how to encode %s: %r"%(repr(data.__class__),data,))
-				inc = getattr(obj,"include",inc)
-				data = obj.encode(data, include=include)
-				if isinstance(data,tuple):
-					obj,data = data
+					raise NotImplementedError("I don't know how to encode %s: %r"%(repr(v.__class__),v,))
+				if simple and getattr(obj,'immutable',False):
+					untracked = True
+				# Marker to use the field key: include 'f' values (data fields)
+				vinc = getattr(obj,"include",2)
+				ov = v
+				v = obj.encode(v, include=inc)
+				if isinstance(v,tuple):
+					obj,v = v
 				else:
 					obj = obj.clsname
+				packer = packers.get(obj,None)
+				if packer is not None:
+					# The serializer has a compact form for this.
+					# Such values are not shared, thus are not recorded.
+					r[k] = packer(v)
+					continue
 			else:
 				obj = None
-				inc = True
-			if not include:
+				vinc = True
+				ov = v
+
+			# Generate a new ID for it.
+			# (There's other stuff in objcache, but that's harmless.)
+			# we need to keep the data around.
+			# Otherwise the address may get reused (data gets dynamically build
+			# by encoding objects), so we get very interesting data corruption effects.
+			if simple:
+				if not untracked:
+					objcache[did] = ov
+				entry = None
+			else:
+				oid = 1+len(objcache)
+				entry = objcache[did] = [oid,None,None,ov]
+
+			if obj == 'LIST':
+				vr = []
+				r[k] = res = {'_o':'LIST','_d':vr}
+				stack.append([iter(v), vr, inc, False, entry,res,None, r,k, untracked])
+				continue
+
+			if not inc:
 				# override with existing None/False values
-				inc = include
-
-			res = type(data)()
-			for k,v in data.items():
-				# Transparent encoding: _ofoo => _o_foo, undone in the decoder
-				# so that our _o and _oi values don't clash with whatever
-				nk = '_o_'+k[2:] if k.startswith('_o') else k
-
-				# inc==2: include regular data values, but not refs or whatever
-				res[nk] = self._encode(v,objcache,objref, include=((k == "f") if (inc == 2) else inc), p=res,off=k)
-
-			if obj is not None:
-				res['_o'] = obj
-
-		did = objcache[did]
-		did[1] = res
-		if did[2] is None:
-			# order non-recursive objects by completion time.
-			# Need to mangle the offset
-			d = objcache['done']
-			did[2] = (d,p,('_o_'+off[2:] if isinstance(off,string_types) and off.startswith('_o') else off))
-			objcache['done'] = d+1
-		return res
+				vinc = inc
+
+			r[k] = res = type(v)()
+			stack.append([iter(v.items()), res, vinc, True, entry,res,obj, r,k, untracked])
+
+		if not simple:
+			objcache['done'] = done
+		return top[0]
 
 	def encode(self, data, _include=False, _raw=False, **kw):
 		"""\
@@ -347,11 +701,37 @@ class BaseCodec(object):
 			           not just a reference. Used server>client. If None,
 			           send object keys without retrieval info. This is used
 			           e.g. when broadcasting, so as to not leak data access.
+
+			@_raw: return the encoded data and the cache list. Binary data
+			       is not passed out-of-band.
 			"""
-		# No, not yet / did not work: slower path
+		# Most messages are trees, so try the fast path first.
+		buffers = [] if self.oob_min and not _raw else None
+		shaped = [] if self.intern and not _raw else None
+		try:
+			res = self._encode(data, {},None, include=_include, buffers=buffers, shaped=shaped)
+		except _SharedObject:
+			if buffers:
+				buffers = []
+			if shaped:
+				shaped = []
+		else:
+			if _raw:
+				return res,[]
+			res = {'data':res}
+			res.update(kw)
+			if buffers:
+				res['buffers'] = buffers
+			if shaped:
+				shapes = self._intern(shaped)
+				if shapes:
+					res['shapes'] = shapes
+			return res
+
+		# Did not work: slower path
 		objcache = {"done":1}
 		objref = {}
-		res = self._encode(data, objcache,objref, include=_include)
+		res = self._encode(data, objcache,objref, include=_include, buffers=buffers, shaped=shaped)
 		del objcache['done']
 		cache = []
 
@@ -374,7 +754,84 @@ class BaseCodec(object):
 		res.update(kw)
 		if cache:
 			res['cache'] = cache
+		if buffers:
+			res['buffers'] = buffers
+		if shaped:
+			# after the fixups above, which modify the dicts
+			shapes = self._intern(shaped)
+			if shapes:
+				res['shapes'] = shapes
 		return res
+
+	def _intern(self, dicts):
+		"""\
+			Replace the contents of dicts which share their type name
+			and keys with {'_os':shape, '_d':[values]}, in place.
+			Returns the list of shapes: [type name, keys…].
+
+			Dicts whose shape occurs only once are left alone.
+			"""
+		counts = {}
+		todo = []
+		for d,t in dicts:
+			oid = d.pop('_oi',None) if '_oi' in d else None
+			shape = (t,)+tuple(d)
+			if shape in counts:
+				counts[shape] = True
+			else:
+				counts[shape] = False
+			todo.append((d,shape,oid))
+
+		shapes = []
+		shape_ids = {}
+		for d,shape,oid in todo:
+			if counts[shape]:
+				n = shape_ids.get(shape,None)
+				if n is None:
+					n = shape_ids[shape] = len(shapes)
+					shapes.append(list(shape))
+				v = list(d.values())
+				d.clear()
+				d['_os'] = n
+				d['_d'] = v
+			elif shape[0] is not None:
+				d['_o'] = shape[0]
+			if oid is not None:
+				d['_oi'] = oid
+		return shapes
+
+	def wrap_message(self, data, buffers=None):
+		"""\
+			Used by serializers: compress a serialized message if
+			it's large enough, and combine it with the `buffers` list
+			which they popped off the encoded message.
+			"""
+		enc = None
+		if self.compress is not None and len(data) >= self.compress_min:
+			if isinstance(data,text_type):
+				data = data.encode('utf-8')
+			data = self._compress(data)
+			enc = self.compress
+		if not buffers and enc is None:
+			return data
+		return WireMessage(data,buffers or (),enc)
+
+	def unwrap_message(self, data):
+		"""\
+			Used by serializers: split a message into the serialized
+			part and its buffers, and decompress it. The buffers need to
+			be stored in the decoded message as `buffers`.
+			"""
+		if not isinstance(data,WireMessage):
+			return data,()
+		body,buffers,enc = data
+		if enc is not None:
+			try:
+				decompress = compressors[enc][1]
+			except KeyError:
+				raise RuntimeError("Unknown compression method",enc)
+			body = decompress(body)
+		return body,buffers
 	
 	def encode_error(self, err, tb=None):
 		"""\
@@ -399,14 +856,16 @@ class BaseCodec(object):
 			res['tb'] = tb
 		return res
 
-	def _decode(self,data, objcache,objtodo, p=None,off=None):
-		# Decode the data recursively.
+	def _decode(self,data, objcache,objtodo, buffers=(), shapes=()):
+		# Decode the data.
 		#
 		# @objcache: dict seqnum=>result
 		# 
-		# @objtodo: Fixup data, list of (seqnum,parent,index). See below.
+		# @objtodo: Fixup data, list of DecodeRef. See below.
+		#
+		# @buffers: the message's out-of-band data.
 		#
-		# @p, @off: parent object and index which refer to this object.
+		# @shapes: the message's shape table, see _intern().
 		#
 		# During decoding, information to recover an object may not be
 		# available, i.e. we encounter an object reference while decoding
@@ -418,56 +877,129 @@ class BaseCodec(object):
 		# within other objects. That'd require a more expensive/intrusive
 		# decoding framework. TODO: Detect this case.
 
-		if isinstance(data, scalar_types):
-			return data
+		# Like the encoder, this code does not recurse. A frame is a list:
+		#   [iterator, result, is_dict, type name, object ID, parent, offset, lazy]
+		# `result` is stored in the parent immediately, to keep the
+		# parent's order intact. Typed objects are replaced with the
+		# decoded result when they're complete.
+		#
+		# `lazy` is set if non-scalar values in this container are to be
+		# left alone. It contains what LazyValue needs to decode them.
+		#
+		# The top level is a fake single-element list.
+		name2cls = self.name2cls
+		scalar_types = self.scalar_types
+		if self.lazy and self.lazy_keys:
+			lazy_keys = self.lazy_keys
+			ctx = (self,objcache,buffers,shapes)
+		else:
+			lazy_keys = None
+		top = []
+		stack = [[iter((data,)), top, False, None,None, None,None, None]]
+		while stack:
+			fr = stack[-1]
+			r = fr[1]
+
+			# Step 1: copy scalars until we find something more complicated
+			if fr[2]:
+				for k,v in fr[0]:
+					if k.startswith("_o"):
+						assert k[2] == '_',k # unknown meta key?
+						k = '_o'+k[3:]
+					if isinstance(v, scalar_types):
+						r[k] = v
+						continue
+					break
+				else:
+					k = None
+			else:
+				for v in fr[0]:
+					if isinstance(v, scalar_types):
+						r.append(v)
+						continue
+					k = len(r)
+					r.append(None)
+					break
+				else:
+					k = None
 
-		# "Unmolested" lists are passed through.
-		if isinstance(data,(list,tuple)):
-			return type(data)(self._decode(v,objcache,objtodo) for v in data)
-
-		if type(data) is dict:
-			oid = data.pop('_oi',None)
-			obj = data.pop('_o',None)
-			objref = data.pop('_or',None)
-			if objref is not None:
-				res = objcache.get(objref,None)
-				if res is None:
-					# Save fixing the problem for later
-					res = DecodeRef(objref,p,off, objcache)
-					objtodo.append(res)
-				return res
+			if k is None:
+				# Step 2a: This container is complete.
+				stack.pop()
+				obj = fr[3]
+				if obj is None:
+					continue
+				if fr[2]:
+					try:
+						res = name2cls[obj].decode(**r)
+					except Exception:
+						logger.error("Decoding: %s:\n%s",obj, pformat(r))
+						logger.error("Decoding:: %r",name2cls.get(obj,None))
+						raise
+					oid = fr[4]
+					if oid is not None:
+						objcache[oid] = res
+				else: # tuple
+					res = obj(r)
+				fr[5][fr[6]] = res
+				continue
+
+			# Step 2b: Process a non-scalar value.
+			if fr[7] is not None and not (type(v) is dict and '_oi' in v):
+				# Objects with an ID might be referred to from elsewhere.
+				r[k] = LazyValue(v,fr[7])
+				continue
+			lazy = None
+			if lazy_keys is not None:
+				lk = lazy_keys.get(fr[3],None)
+				if lk is not None and k in lk:
+					lazy = ctx
+
+			if type(v) is dict:
+				oid = v.pop('_oi',None)
+				shape = v.get('_os',None)
+				if shape is not None:
+					shape = shapes[shape]
+					obj = shape[0]
+					r[k] = res = {}
+					if obj is None and oid is not None:
+						objcache[oid] = res
+					stack.append([iter(zip(shape[1:],v['_d'])), res, True, obj,oid, r,k, lazy])
+					continue
+				obj = v.pop('_o',None)
+				objref = v.pop('_or',None)
+				if objref is not None:
+					res = objcache.get(objref,None)
+					if res is None:
+						# Save fixing the problem for later
+						res = DecodeRef(objref,r,k, objcache)
+						objtodo.append(res)
+					r[k] = res
+
+				elif obj == 'LIST':
+					r[k] = res = []
+					if oid is not None:
+						objcache[oid] = res
+					stack.append([iter(v['_d']), res, False, None,None, r,k, lazy])
+
+				elif obj == 'BUF':
+					r[k] = buffers[v['i']]
 
-			if obj == 'LIST':
-				res = []
-				if oid is not None:
-					objcache[oid] = res
-				k = 0
-				for v in data['_d']:
-					res.append(self._decode(v,objcache,objtodo, res,k))
-					k += 1
-				return res
-			
-			res = {}
-			for k,v in data.items():
-				if k.startswith("_o"):
-					assert k[2] == '_',nk # unknown meta key?
-					nk = '_o'+k[3:]
 				else:
-					nk = k
-				res[nk] = self._decode(v,objcache,objtodo, res,k)
+					r[k] = res = {}
+					if obj is None and oid is not None:
+						objcache[oid] = res
+					stack.append([iter(v.items()), res, True, obj,oid, r,k, lazy])
 
-			if obj is not None:
-				try:
-					res = self.name2cls[obj].decode(**res)
-				except Exception:
-					logger.error("Decoding: %s:\n%s\n%s",obj,pformat(data), pformat(res))
-					logger.error("Decoding:: %r",self.name2cls[obj])
-					raise
-			if oid is not None:
-				objcache[oid] = res
-			return res
+			elif isinstance(v,(list,tuple)):
+				# "Unmolested" lists are passed through.
+				r[k] = res = []
+				stack.append([iter(v), res, False, (None if type(v) is list else type(v)),None, r,k, lazy])
+
+			else:
+				raise NotImplementedError("Don't know how to decode %r"%v)
 
-		raise NotImplementedError("Don't know how to decode %r"%data)
+		return top[0]
 	
 	def _cleanup(self, objcache,objtodo):
 		# resolve the "todo" stuff
@@ -503,17 +1035,72 @@ class BaseCodec(object):
 
 		if _cache is None:
 			cache = data.pop('cache',())
+			buffers = data.pop('buffers',())
+			shapes = data.pop('shapes',())
 			data = data.data
 		else:
 			cache = _cache
+			buffers = ()
+			shapes = ()
 
 		for obj in cache:
-			self._decode(obj, objcache,objtodo)
+			self._decode(obj, objcache,objtodo, buffers,shapes)
 			# side effect: populate objcache
 
-		res = self._decode(data, objcache,objtodo)
+		res = self._decode(data, objcache,objtodo, buffers,shapes)
 		self._cleanup(objcache,objtodo)
 		if isinstance(res,DecodeRef):
 			res = objcache[res.oid]
 		return res
 
+	def decode2_iter(self,data,_cache=None):
+		"""\
+			Like decode2, but if the message contents is a list, yield
+			its elements one at a time. Each element is decoded when it's
+			requested, and its encoded form is released afterwards.
+
+			Anything else is decoded normally and yielded as the only
+			element.
+			"""
+		if _cache is None:
+			cache = data.get('cache',())
+			buffers = data.get('buffers',())
+			shapes = data.get('shapes',())
+			items = data.data
+		else:
+			cache = _cache
+			buffers = ()
+			shapes = ()
+			items = data
+
+		if type(items) is dict and items.get('_o',None) == 'LIST' and '_oi' not in items:
+			items = items['_d']
+		elif type(items) is not list:
+			# Either not a list, or a list which refers to itself.
+			yield self.decode2(data,_cache=_cache)
+			return
+
+		objcache = {}
+		objtodo = []
+		for obj in cache:
+			self._decode(obj, objcache,objtodo, buffers,shapes)
+			# side effect: populate objcache
+
+		for i in range(len(items)):
+			res,items[i] = items[i],None
+			res = self._decode(res, objcache,objtodo, buffers,shapes)
+			if objtodo:
+				# resolve whatever we can
+				todo = []
+				for d in objtodo:
+					r = objcache.get(d.oid,_notGiven)
+					if r is _notGiven:
+						todo.append(d)
+					else:
+						d.parent[d.offset] = r
+				objtodo = todo
+			if isinstance(res,DecodeRef):
+				res = objcache[res.oid]
+			yield res
+		self._cleanup(objcache,objtodo)
+
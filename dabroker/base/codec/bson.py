@@ -18,13 +18,17 @@ from bson import BSON
 class Codec(BaseCodec):
 	def encode(self, data, *a,**k):
 		msg = super(Codec,self).encode(data, *a,**k)
-		return BSON.encode(msg)
+		buffers = msg.pop('buffers',None)
+		return self.wrap_message(BSON.encode(msg),buffers)
 	
 	def encode_error(self, err, tb=None):
 		msg = super(Codec,self).encode_error(err, tb=tb)
-		return BSON.encode(msg)
+		return self.wrap_message(BSON.encode(msg))
 	
 	def decode(self, data, *a,**k):
+		data,buffers = self.unwrap_message(data)
 		msg = BSON(data).decode()
+		if buffers:
+			msg['buffers'] = buffers
 		return super(Codec,self).decode(msg, *a,**k)
 
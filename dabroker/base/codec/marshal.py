@@ -21,19 +21,23 @@ logger = logging.getLogger("dabroker.codec.marshal")
 class Codec(BaseCodec):
 	def encode(self, data, *a,**k):
 		msg = super(Codec,self).encode(data, *a,**k)
+		buffers = msg.pop('buffers',None)
 		msg = dumps(msg)
 		logger.info("OUT %r",msg)
-		return msg
+		return self.wrap_message(msg,buffers)
 	
 	def encode_error(self, err, tb=None):
 		msg = super(Codec,self).encode_error(err, tb=tb)
 		msg = dumps(msg)
 		logger.info("ERR %r",msg)
 		logger.info(msg)
-		return msg
+		return self.wrap_message(msg)
 	
 	def decode(self, data, *a,**k):
+		data,buffers = self.unwrap_message(data)
 		msg = loads(data)
+		if buffers:
+			msg['buffers'] = buffers
 		logger.info("IN  %r",msg)
 		return super(Codec,self).decode(msg, *a,**k)
 
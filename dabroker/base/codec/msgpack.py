@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+from . import BaseCodec, array_to_bytes, datetime_to_us,us_to_datetime, time_to_us,us_to_time, timedelta_to_us,us_to_timedelta
+from msgpack import packb,unpackb,ExtType, version as msgpack_version
+from struct import Struct
+from array import array
+import datetime as dt
+
+import logging
+logger = logging.getLogger("dabroker.codec.msgpack")
+
+# Extension type codes. Do not change these.
+EXT_DATETIME = 1  # int64: microseconds since the epoch
+EXT_DATE = 2      # int32: proleptic Gregorian ordinal
+EXT_TIME = 3      # int64: microseconds since midnight
+EXT_TIMEDELTA = 4 # int64: microseconds
+EXT_REF = 5       # msgpack array: [key, code]
+EXT_ARRAY = 6     # typecode (one byte), then the array's little-endian data
+
+_int64 = Struct(">q")
+_int32 = Struct(">i")
+_unpack_args = dict(raw=False, ext_hook=None)
+if msgpack_version >= (0,6,1):
+	_unpack_args['strict_map_key'] = False
+
+def _default(obj):
+	# datetime is a subclass of date, so test it first
+	if isinstance(obj,dt.datetime):
+		return ExtType(EXT_DATETIME, _int64.pack(datetime_to_us(obj)))
+	if isinstance(obj,dt.date):
+		return ExtType(EXT_DATE, _int32.pack(obj.toordinal()))
+	if isinstance(obj,dt.time):
+		return ExtType(EXT_TIME, _int64.pack(time_to_us(obj)))
+	if isinstance(obj,dt.timedelta):
+		return ExtType(EXT_TIMEDELTA, _int64.pack(timedelta_to_us(obj)))
+	raise TypeError("I don't know how to pack %s: %r" % (repr(obj.__class__),obj))
+
+def _ext_hook(code, data):
+	if code == EXT_DATETIME:
+		return us_to_datetime(_int64.unpack(data)[0])
+	if code == EXT_DATE:
+		return dt.date.fromordinal(_int32.unpack(data)[0])
+	if code == EXT_TIME:
+		return us_to_time(_int64.unpack(data)[0])
+	if code == EXT_TIMEDELTA:
+		return us_to_timedelta(_int64.unpack(data)[0])
+	if code == EXT_REF:
+		# Turned back into a dict, so that the client's or server's
+		# adapter for "Ref" gets to decode it.
+		k,c = unpackb(data, **_unpack_args)
+		return {'_o':"Ref", 'k':k, 'c':c}
+	if code == EXT_ARRAY:
+		# Passed to the adapter for "array", like Ref.
+		return {'_o':"array", 't':data[0:1].decode('ascii'), 'b':data[1:]}
+	return ExtType(code, data)
+_unpack_args['ext_hook'] = _ext_hook
+
+def _pack_ref(ref):
+	return ExtType(EXT_REF, packb((ref['k'],ref.get('c',None)), use_bin_type=True))
+
+def _pack_array(arr):
+	t = arr['t']
+	return ExtType(EXT_ARRAY, t.encode('ascii')+array_to_bytes(array(str(t),arr['d'])))
+
+class Codec(BaseCodec):
+	native_types = (dt.datetime,dt.date,dt.time,dt.timedelta)
+	packers = {"Ref":_pack_ref, "array":_pack_array}
+
+	def encode(self, data, *a,**k):
+		msg = super(Codec,self).encode(data, *a,**k)
+		buffers = msg.pop('buffers',None)
+		msg = packb(msg, default=_default, use_bin_type=True)
+		logger.info("OUT %r",msg)
+		return self.wrap_message(msg,buffers)
+
+	def encode_error(self, err, tb=None):
+		msg = super(Codec,self).encode_error(err, tb=tb)
+		msg = packb(msg, default=_default, use_bin_type=True)
+		logger.info("ERR %r",msg)
+		return self.wrap_message(msg)
+
+	def decode(self, data, *a,**k):
+		data,buffers = self.unwrap_message(data)
+		msg = unpackb(data, **_unpack_args)
+		if buffers:
+			msg['buffers'] = buffers
+		logger.info("IN  %r",msg)
+		return super(Codec,self).decode(msg, *a,**k)
+
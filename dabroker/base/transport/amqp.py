@@ -13,6 +13,8 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 ##BP
 
 from . import BaseTransport
+from ..codec import WireMessage
+from six import text_type, PY2
 
 import amqp
 
@@ -64,13 +66,71 @@ class AmqpTransport(BaseTransport):
 		raise NotImplementedError("Duh")
 
 	def encode_msg(self,msg, **attrs):
+		"""\
+			Build an AMQP message.
+
+			The compression method goes to the x-dab-compress header, not
+			to `content_encoding`: py-amqp sets that to the charset of a
+			text body, and decodes bodies with it when they arrive.
+			"""
 		attrs.setdefault('content_type',self.content_type)
+		if isinstance(msg,WireMessage):
+			if msg.encoding is not None:
+				attrs.setdefault('application_headers',{})['x-dab-compress'] = msg.encoding
+			if msg.buffers:
+				msg = self._frame(msg,attrs)
+			else:
+				msg = msg.body
 		msg = amqp.Message(body=msg, **attrs)
 		return msg
  
 	def decode_msg(self,msg):
 		assert msg.content_type == self.content_type, (msg.content_type,self.content_type)
-		return msg.body
+		hdr = msg.properties.get('application_headers',None) or {}
+		enc = hdr.get('x-dab-compress',None)
+		if 'x-dab-buffers' in hdr:
+			body,buffers = self._unframe(msg.body,hdr)
+		elif enc is not None:
+			body,buffers = msg.body,()
+		else:
+			return msg.body
+		return WireMessage(body,buffers,enc)
+
+	def _frame(self,msg,attrs):
+		"""\
+			Out-of-band buffers are appended to the message body. Their
+			lengths are sent in the x-dab-buffers header.
+			"""
+		body,buffers,_ = msg
+		hdr = attrs.setdefault('application_headers',{})
+		if isinstance(body,text_type):
+			body = body.encode('utf-8')
+			hdr['x-dab-text'] = True
+		chunks = [body]
+		for b in buffers:
+			# Python 2 can't join anything but strings
+			if PY2 and type(b) is not bytes:
+				b = b.tobytes() if type(b) is memoryview else bytes(b)
+			chunks.append(b)
+		hdr['x-dab-buffers'] = [len(b) for b in chunks]
+		return b''.join(chunks)
+
+	def _unframe(self,data,hdr):
+		"""\
+			Split a framed message. The buffers are memoryview slices
+			of the message body, thus are not copied.
+			"""
+		data = memoryview(data)
+		lens = hdr['x-dab-buffers']
+		body = data[0:lens[0]].tobytes()
+		if hdr.get('x-dab-text',False):
+			body = body.decode('utf-8')
+		buffers = []
+		pos = lens[0]
+		for n in lens[1:]:
+			buffers.append(data[pos:pos+n])
+			pos += n
+		return body,buffers
 
 	def run(self):
 		logger.debug("Receiver loop on %r %r",self.connection,self.channel)
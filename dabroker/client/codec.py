@@ -14,10 +14,14 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 
 from weakref import ref,WeakValueDictionary
 from functools import partial
+import datetime as dt
+from time import time
 
 from . import ClientBaseRef,ClientBaseObj
 from ..base import BaseRef,BaseObj, BrokeredInfo, BrokeredInfoInfo, adapters as baseAdapters, common_BaseObj,common_BaseRef, NoData,ManyData
 from ..base.service import current_service
+from ..base.codec import LazyValue
+from ..util.thread import spawned
 
 import logging
 logger = logging.getLogger("dabroker.client.serial")
@@ -26,8 +30,144 @@ class _NotGiven: pass
 
 class CacheProxy(object):
 	"""Can't weakref a string, so …"""
-	def __init__(self,data):
+	expires = None # when a call result goes stale, if it has a TTL
+	refreshing = False
+
+	def __init__(self,data, meta=None):
 		self.data = data
+		self.meta = meta
+
+class SearchDict(WeakValueDictionary,object):
+	"""\
+		The known searches on a meta object: search key => KnownSearch.
+
+		Searches are indexed by the values they look for, so that
+		`affected` only needs to check those which a change can match.
+		Keywords starting with an underscore are not indexed.
+		"""
+	def __init__(self, *args, **kw):
+		self.shapes = {} # frozenset of keywords => search keys
+		self.values = {} # (keyword,value) => search keys
+		self.loose = {} # keyword => search keys with an unhashable value
+		self.entries = {} # search key => where it's indexed
+		super(SearchDict,self).__init__(*args,**kw)
+		def remove(wr, selfref=ref(self)):
+			self = selfref()
+			if self is not None and self.data.get(wr.key,None) is wr:
+				if self._iterating and hasattr(self,'_pending_removals'):
+					self._pending_removals.append(wr.key)
+				else:
+					del self.data[wr.key]
+				self._unindex(wr.key)
+		self._remove = remove
+
+	def _index(self, kws, kw):
+		self._unindex(kws)
+		names = frozenset(k for k in kw if not k.startswith('_'))
+		entries = [(self.shapes,names)]
+		for k in names:
+			v = (k,kw[k])
+			try:
+				hash(v)
+			except TypeError:
+				entries.append((self.loose,k))
+			else:
+				entries.append((self.values,v))
+		for d,x in entries:
+			d.setdefault(x,set()).add(kws)
+		self.entries[kws] = entries
+
+	def _unindex(self, kws):
+		for d,x in self.entries.pop(kws,()):
+			s = d.get(x,None)
+			if s is not None:
+				s.discard(kws)
+				if not s:
+					del d[x]
+
+	def __setitem__(self, kws, search):
+		super(SearchDict,self).__setitem__(kws,search)
+		self._index(kws, search.kw)
+
+	def __delitem__(self, kws):
+		super(SearchDict,self).__delitem__(kws)
+		self._unindex(kws)
+
+	def pop(self, kws, *default):
+		self._unindex(kws)
+		return super(SearchDict,self).pop(kws, *default)
+
+	def affected(self, k):
+		"""\
+			Return the keys of the searches which a change might affect.
+
+			@k maps the names of the changed fields to a tuple of values:
+			(old,new) for an update, (value,) for a new or deleted object.
+
+			A search is affected if, for all fields in @k which it
+			constrains, it looks for one of the values. A search which
+			constrains none of them is affected unless this is an update.
+			"""
+		is_update = any(len(v) > 1 for v in k.values())
+		res = []
+		for names,kwss in list(self.shapes.items()):
+			common = names.intersection(k)
+			if not common:
+				if not is_update:
+					res.extend(kwss)
+				continue
+
+			# Every affected search looks for one of the values of
+			# any field in `common`. Pick one.
+			f = next(iter(common))
+			cand = set(self.loose.get(f,()))
+			try:
+				for v in k[f]:
+					cand.update(self.values.get((f,v),()))
+			except TypeError: # unhashable
+				cand = kwss
+			for kws in cand.intersection(kwss):
+				s = self.get(kws,None)
+				if s is None:
+					continue
+				for i in common:
+					if s.kw[i] not in k[i]:
+						break
+				else:
+					res.append(kws)
+		return res
+
+	def containing(self, kw):
+		"""\
+			Yield the known complete searches whose results include those
+			of a search for @kw, i.e. which look for a subset of its
+			keywords (with the same values). Counts are skipped.
+			"""
+		names = frozenset(k for k in kw if not k.startswith('_'))
+		for shape,kwss in list(self.shapes.items()):
+			if not shape <= names:
+				continue
+			if shape:
+				# Every candidate looks for the same value of any of
+				# its keywords. Pick one.
+				f = next(iter(shape))
+				cand = set(self.loose.get(f,()))
+				try:
+					cand.update(self.values.get((f,kw[f]),()))
+				except TypeError: # unhashable
+					cand = kwss
+				cand.intersection_update(kwss)
+			else:
+				cand = kwss
+			for kws in list(cand):
+				s = self.get(kws,None)
+				if s is None or s.limit or s.count:
+					continue
+				for k in shape:
+					if kstr(s.kw[k]) != kstr(kw[k]):
+						break
+				else:
+					yield s
 
 def kstr(v):
 	k = getattr(v,'__dict__',None)
@@ -86,7 +226,7 @@ class ClientBrokeredInfo(ClientBaseObj,BrokeredInfo):
 		"""
 	def __init__(self,*a,**k):
 		super(ClientBrokeredInfo,self).__init__(*a,**k)
-		self.searches = WeakValueDictionary()
+		self.searches = SearchDict()
 		self._class = None
 
 	def __call__(self, _is_meta=False, *a,**kw):
@@ -109,8 +249,13 @@ class ClientBrokeredInfo(ClientBaseObj,BrokeredInfo):
 					pass
 			cls = ClientInfo
 
+			srv = current_service.top
+			if srv is not None and srv.codec.lazy:
+				fp = LazyFieldProperty
+			else:
+				fp = FieldProperty
 			for k in self.fields.keys():
-				setattr(cls, '_dab_'+k if hasattr(cls,k) else k,FieldProperty(k))
+				setattr(cls, '_dab_'+k if hasattr(cls,k) else k,fp(k))
 			for k in self.refs.keys():
 				if k != '_meta':
 					setattr(cls, '_dab_'+k if hasattr(cls,k) else k,RefProperty(k))
@@ -127,7 +272,7 @@ class ClientBrokeredInfo(ClientBaseObj,BrokeredInfo):
 	def find(self, **kw):
 		if self.cached is None:
 			raise RuntimeError("You cannot search "+repr(self))
-		for r in self.client.find(self, _cached=self.cached, **kw):
+		for r in self.client.find(self, _cached=self.cached, _stream=True, **kw):
 			if not isinstance(r,BaseObj):
 				r = r()
 			yield r
@@ -194,6 +339,30 @@ class FieldProperty(object):
 			import pdb;pdb.set_trace()
 			obj._meta._dab.obj_change(obj, self.name, ov,val)
 
+class LazyFieldProperty(FieldProperty):
+	"""Like FieldProperty, but decodes LazyValue objects when accessed."""
+	def __get__(self, obj, type=None):
+		if obj is None:
+			return self
+		try:
+			val = obj.__dict__[self.name]
+		except KeyError:
+			raise AttributeError(self.name)
+		if val.__class__ is LazyValue:
+			dab = getattr(obj,'_dab',None)
+			if dab is None:
+				val = val.get()
+			else:
+				with dab.env:
+					val = val.get()
+			obj.__dict__[self.name] = val
+		return val
+
+	def __set__(self, obj, val):
+		if obj.__dict__.get(self.name,None).__class__ is LazyValue:
+			self.__get__(obj)
+		super(LazyFieldProperty,self).__set__(obj,val)
+
 class RefProperty(object):
 	"""This property accessor handles referred objects"""
 	def __init__(self, name):
@@ -258,10 +427,19 @@ class BackRefHandler(object):
 		return obj._meta._dab.send("backref_len",obj, self.name)
 
 class RpcProperty(object):
-	"""This property accessor returns a shim which executes a RPC to the server."""
+	"""\
+		This property accessor returns a shim which executes a RPC to the server.
+
+		If the Callable has a `ttl`, cached results are used for that many
+		seconds. After that they're stale: for another `stale` seconds
+		they're still returned immediately, while a background thread
+		fetches a new value.
+		"""
 	def __init__(self, proc):
 		self.name = proc.name
-		self.cached = getattr(proc,'cached',False)
+		self.ttl = getattr(proc,'ttl',None)
+		self.stale = getattr(proc,'stale',None) or 0
+		self.cached = getattr(proc,'cached',False) or self.ttl is not None
 		self.for_class = getattr(proc,'for_class',None)
 		self.meta = getattr(proc,'meta',False)
 
@@ -271,18 +449,45 @@ class RpcProperty(object):
 				kws = self.name+':'+search_key(a,**k)
 				ckey = " ".join(str(x) for x in obj._key.key)+":"+kws
 
-				res = obj._call_cache.get(kws,_NotGiven)
-				if res is not _NotGiven:
-					res = res.data
-					current_service.top._cache[ckey] # Lookup to increase counter
-					return res
+				rc = obj._call_cache.get(kws,None)
+				if rc is not None:
+					dab = current_service.top
+					dab._cache[ckey] # Lookup to increase counter
+					if rc.expires is None or time() < rc.expires:
+						dab.stats.add(obj._meta,"call","hit")
+						return rc.data
+					if time() < rc.expires+self.stale:
+						dab.stats.add(obj._meta,"call","stale")
+						if not rc.refreshing:
+							rc.refreshing = True
+							self._refresh(obj,kws,ckey,rc, a,dict(k))
+						return rc.data
 			res = obj._meta._dab.call(obj,self.name, a,k, _meta=self.meta)
 			if self.cached and not obj._obsolete:
-				rc = CacheProxy(res)
-				obj._call_cache[kws] = rc
-				current_service.top._cache[ckey] = rc
+				current_service.top.stats.add(obj._meta,"call","miss")
+				self._store(obj,kws,ckey,res)
 			return res
 
+	def _store(self, obj,kws,ckey,res):
+		rc = CacheProxy(res, getattr(obj,'_meta',None))
+		if self.ttl is not None:
+			rc.expires = time()+self.ttl
+		obj._call_cache[kws] = rc
+		current_service.top._cache[ckey] = rc
+
+	@spawned
+	def _refresh(self, obj,kws,ckey,rc, a,k):
+		"""Replace the stale cached result @rc"""
+		with obj._dab.env:
+			try:
+				res = obj._meta._dab.call(obj,self.name, a,k, _meta=self.meta)
+			except Exception:
+				logger.exception("Refreshing %s on %r",self.name,obj)
+				rc.refreshing = False
+				return
+			if not obj._obsolete and obj._call_cache.get(kws,None) is rc:
+				self._store(obj,kws,ckey,res)
+
 	def __get__(self, obj, type=None):
 		if self.for_class is None: # normal method
 			if obj is None:
@@ -304,6 +509,7 @@ class client_BaseRef(common_BaseRef):
 
 @codec_adapter
 class client_BaseObj(common_BaseObj):
+	lazy = ('f','v') # see LazyFieldProperty
 
 	@classmethod
 	def encode_ref(obj,k):
@@ -319,9 +525,12 @@ class client_BaseObj(common_BaseObj):
 	
 
 	@classmethod
-	def decode(cls, k,c=None,f=None,r=None, _is_meta=False):
+	def decode(cls, k,c=None,f=None,r=None,v=None, _is_meta=False):
 		"""\
 			Convert this object to a class
+
+			@v is the compact form of @f and @r, see
+			BrokeredInfo.obj_encoder().
 			"""
 
 		k = ClientBaseRef(key=tuple(k),code=c)
@@ -329,31 +538,112 @@ class client_BaseObj(common_BaseObj):
 		if not r or '_meta' not in r:
 			raise RuntimeError("Object without meta data")
 
-		m = r['_meta']
+		m = r.pop('_meta')
 		if not isinstance(m,ClientBrokeredInfo):
 			# assume it's a reference, so resolve it
-			r['_meta'] = m = m()
+			m = m()
+
+		if v is not None:
+			fields,refs,sig = m.layout()
+			if v[0] != sig:
+				raise RuntimeError("Object layout does not match its metadata",m)
+			n = len(fields)+1
+			f = dict(zip(fields,v[1:n]))
+			r.update((k,(x.get() if x.__class__ is LazyValue else x)) for k,x in zip(refs,v[n:]))
+		elif f is None:
+			f = {}
+
+		# If we already have this object, update it.
+		dab = current_service.top
+		if not _is_meta:
+			res = dab._cache.get(k,None)
+			if isinstance(res,ClientBaseObj) and res._meta is m:
+				return dab._update_cached(res, f,r)
+
+		# Otherwise, get the class and fill it with data.
+		# Do not use setattr here, it tries to record a change.
 		res = m(_is_meta)
 		res._key = k
+		res.__dict__.update(f)
+		res._meta = m
+		res._refs.update(r)
 
-		# Got the class, now fill it with data
-		if f:
-			for k,v in f.items():
-				res.__dict__[k] = v
-				# do not use setattr here, it tries to record a change
-		if r:
-			for k,v in r.items():
-				if k == '_meta':
-					res._meta = v
-				else:
-					res._refs[k] = v
-
-		return current_service.top._add_to_cache(res)
+		return dab._add_to_cache(res)
 	
+class ColumnResult(object):
+	"""\
+		A search result which the server sent column by column.
+
+		This behaves like a list of objects. They are created when
+		they're first accessed.
+
+		`columns` maps the names of the objects' fields and references to
+		their columns. Columns of integers, floats and dates are arrays
+		(from the `array` module); dates are stored as ordinals, their
+		names are listed in `dates`. Reference columns contain keys.
+		"""
+	def __init__(self, meta, sig, keys,codes, fields,refs,dates):
+		if not isinstance(meta,ClientBrokeredInfo):
+			meta = meta()
+		names,rnames,msig = meta.layout()
+		if sig != msig:
+			raise RuntimeError("Column layout does not match its metadata",meta)
+		self.meta = meta
+		self.client = current_service.top
+		self.keys = keys
+		self.codes = codes
+		self.columns = dict(zip(names,fields))
+		self.columns.update(zip(rnames,refs))
+		self.dates = set(names[i] for i in dates)
+		self._objs = [None]*len(keys)
+
+	def __len__(self):
+		return len(self._objs)
+
+	def __getitem__(self, i):
+		if isinstance(i,slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		res = self._objs[i]
+		if res is None:
+			with self.client.env:
+				res = self._objs[i] = self._make(i)
+		return res
+
+	def __iter__(self):
+		for i in range(len(self._objs)):
+			yield self[i]
+
+	def _make(self, i):
+		f = {}
+		r = {'_meta':self.meta}
+		refs = self.meta.refs
+		for k,col in self.columns.items():
+			v = col[i]
+			if k in refs:
+				r[k] = v
+			elif k in self.dates:
+				f[k] = dt.date.fromordinal(v)
+			else:
+				f[k] = v
+		return client_BaseObj.decode(k=self.keys[i],c=self.codes[i], f=f,r=r)
+
+	def __repr__(self):
+		return "‹C:{}:{}›".format(self.meta.name,len(self))
+
+@codec_adapter
+class client_Columns(object):
+	cls = None # never sent by the client
+	clsname = "Cols"
+
+	@staticmethod
+	def decode(m,s,k,c,f,r,d=()):
+		return ColumnResult(m,s,k,c,f,r,d)
+
 @codec_adapter
 class client_InfoObj(client_BaseObj):
 	cls = ClientBrokeredInfo
 	clsname = "Info"
+	lazy = None # meta objects are used immediately
 		
 	@staticmethod
 	def decode(k=None,c=None,f=None, **kw):
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This module stores a copy of the client's cache in a file, so that a
+# restarted client does not need to fetch everything again.
+
+import sqlite3
+import sys
+
+# Bump this when the stored data changes. The marshal format depends on
+# the Python version, so that's part of it.
+FORMAT = "1:{}.{}".format(*sys.version_info[:2])
+
+# What a row holds
+OBJ = 0
+META = 1
+ROOT = 2
+
+class CacheFile(object):
+	"""\
+		An SQLite database with the objects a client has cached.
+
+		`info` holds the server's epoch and the last broadcast message ID
+		which the stored objects reflect. `objects` holds the objects,
+		encoded as {k,c,f,r} dicts (like the server sends them).
+		"""
+	def __init__(self, path):
+		self.db = sqlite3.connect(path)
+		with self.db:
+			self.db.execute("create table if not exists info (name text primary key, value)")
+			self.db.execute("create table if not exists objects (kind integer, data blob)")
+
+	def close(self):
+		self.db.close()
+		self.db = None
+
+	def info(self):
+		"""Return the stored info, or an empty dict if the format doesn't match."""
+		res = dict(self.db.execute("select name,value from info"))
+		if res.get('format',None) != FORMAT:
+			return {}
+		return res
+
+	def load(self):
+		"""Yield (kind,data) for all stored objects, metadata first."""
+		for kind,data in self.db.execute("select kind,data from objects order by kind=? desc", (META,)):
+			yield kind,bytes(data)
+
+	def save(self, info, objects):
+		"""Replace the file's content with @info (a dict) and @objects, a list of (kind,data) tuples."""
+		info = dict(info)
+		info['format'] = FORMAT
+		with self.db:
+			self.db.execute("delete from info")
+			self.db.execute("delete from objects")
+			self.db.executemany("insert into info values (?,?)", info.items())
+			self.db.executemany("insert into objects values (?,?)", ((k,sqlite3.Binary(d)) for k,d in objects))
@@ -17,30 +17,52 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 RETR_TIMEOUT = 10
 CACHE_SIZE=10000
 
-from ..base import UnknownCommandError,BaseRef
+from ..base import UnknownCommandError,BaseRef,NoData
 from ..base.transport import BaseCallbacks
 from ..base.config import default_config
-from ..base.codec import ServerError
+from ..base.codec import ServerError,LazyValue
 from ..base.service import BrokerEnv
 from ..util import import_string
 from ..util.thread import spawned, AsyncResult
-from .codec import adapters, client_broker_info_meta, search_key
+from .codec import adapters, client_broker_info_meta, search_key, CacheProxy, ClientBrokeredInfo, client_BaseObj,client_InfoObj
+from .persist import CacheFile, OBJ,META,ROOT
+from . import ClientBaseRef,ClientBaseObj
 
 import logging
 logger = logging.getLogger("dabroker.client.service")
 
 from weakref import WeakValueDictionary,KeyedRef,ref
-from collections import deque
-from heapq import heapify,heappop
+from sys import getsizeof
+from collections import deque, OrderedDict
+from heapq import heapify,heappop,nlargest
+from operator import attrgetter
 
 class _NotGiven: pass
 
 class KnownSearch(object):
-	def __init__(self, kw, res, ckey, limit=0):
+	def __init__(self, kw, res, ckey, limit=0, count=False):
 		self.kw = kw
 		self.res = res
 		self.ckey = ckey
 		self.limit = limit
+		self.count = count
+
+class Missing(object):
+	"""\
+		Cached in place of an object which the server doesn't have, so
+		that looking for it again doesn't need a round trip. Dropped when
+		the server broadcasts that the object has been created.
+
+		@meta is the class of the object, if the reference knew it.
+		"""
+	_obsolete = False
+
+	def __init__(self, error, meta=None):
+		self.error = error
+		self._meta = meta
+
+	def _obsoleted(self):
+		pass
 
 class ExtKeyedRef(KeyedRef):
 	"""A KeyedRef which includes an access counter."""
@@ -61,7 +83,14 @@ class ExtKeyedRef(KeyedRef):
 		# Yes, this is backwards. That is intentional. See below.
 
 class CountedCache(WeakValueDictionary,object):
-	"""A WeakValueDictionary which counts accesses."""
+	"""\
+		A WeakValueDictionary which counts accesses.
+
+		If `stats` is set to a CacheStats object, evictions and
+		invalidations are counted there.
+		"""
+	stats = None
+
 	def __init__(self, *args, **kw):
 		super(CountedCache,self).__init__(*args,**kw)
 		def remove(wr, selfref=ref(self)):
@@ -84,6 +113,16 @@ class CountedCache(WeakValueDictionary,object):
 			r.counter += 1
 			return o
 
+	def get(self, key, default=None):
+		r = self.data.get(key,None)
+		if r is None:
+			return default
+		o = r()
+		if o is None:
+			return default
+		r.counter += 1
+		return o
+
 	def get_ref(self, key, default=None):
 		return self.data.get(key, default)
 
@@ -91,7 +130,23 @@ class CountedCache(WeakValueDictionary,object):
 		r = self.data.get(key,None)
 		if r is None:
 			return -1
-		return r.count
+		return r.counter
+
+	def hot(self, n=10):
+		"""Return the @n most-used (value,counter) pairs."""
+		res = []
+		for r in nlargest(n*2, self.data.values(), key=attrgetter('counter')):
+			o = r()
+			if o is not None:
+				res.append((o,r.counter))
+				if len(res) == n:
+					break
+		return res
+
+	def _evicted(self, key,value):
+		"""The cache no longer holds on to this item."""
+		if self.stats is not None:
+			self.stats.add(entry_meta(value),"cache","evict")
 
 	def __setitem__(self, key, value):
 		if getattr(self,'_pending_removals',False):
@@ -136,6 +191,43 @@ class CountedCache(WeakValueDictionary,object):
 		if len(kwargs):
 			self.update(kwargs)
 
+	def pinned(self):
+		"""Iterate over the (key,value) pairs which the cache holds on to."""
+		return ()
+
+	def _entry_size(self, key,value):
+		return entry_size(value)
+
+	def usage(self):
+		"""\
+			Report what the cache holds on to, by meta object name:
+			{name: {'count':number of items, 'bytes':estimated size}}.
+			"""
+		res = {}
+		for k,v in self.pinned():
+			name = entry_meta(v)
+			u = res.get(name,None)
+			if u is None:
+				res[name] = u = {'count':0, 'bytes':0}
+			u['count'] += 1
+			u['bytes'] += self._entry_size(k,v)
+		return res
+
+	def invalidate(self,key):
+		"""Drop an object from the cache and mark it as obsolete."""
+		obj = self.get_ref(key)
+		if obj is not None:
+			obj = obj()
+		if isinstance(obj,(AsyncResult,type(None))):
+			return
+		obj = self.pop(key,None)
+		if obj is None:
+			return
+		if self.stats is not None:
+			self.stats.add(entry_meta(obj),"cache","invalid")
+		obj._obsolete = True
+		obj._obsoleted()
+
 class CacheDict(CountedCache):
 	"""\
 		This is an augmented WeakValueDict which keeps the last CACHE_SIZE items pinned.
@@ -148,13 +240,16 @@ class CacheDict(CountedCache):
 
 		"""
 	def __init__(self,*a,**k):
+		size = k.pop('size',CACHE_SIZE)
+		if k.pop('memory',None):
+			raise RuntimeError("This cache cannot limit its memory use")
 		self.lru = {}
 		self.lru_next = 0
 		self.lru_last = 0
-		self.lru_size = CACHE_SIZE
+		self.lru_size = size
 
-		self.heap_min = CACHE_SIZE//20
-		self.heap_max = CACHE_SIZE//10
+		self.heap_min = size//20
+		self.heap_max = size//10
 		self.heap = []
 		super(CacheDict,self).__init__(*a,**k)
 
@@ -195,19 +290,327 @@ class CacheDict(CountedCache):
 					id = self.lru_next; self.lru_next += 1
 					ref.counter = 0
 					self.lru[id] = (key,value)
+				else:
+					self._evicted(key,value)
+			for ref,key,value in self.heap:
+				self._evicted(key,value)
 
 			self.heap = [] ## optional
 
-	def invalidate(self,key):
-		obj = self.get(key,None)
-		if isinstance(obj,(AsyncResult,type(None))):
-			return
-		obj = self.pop(key,None)
-		if obj is None:
+	def pinned(self):
+		# an item may be in the FIFO more than once
+		return dict(self.lru.values()).items()
+
+# halves every counter of a FrequencySketch
+_halved = bytes(bytearray(i>>1 for i in range(256)))
+
+class FrequencySketch(object):
+	"""\
+		Estimates how often a key has been seen recently, in a fixed
+		amount of memory (a count-min sketch with four rows).
+
+		Counters saturate at 15. After 10*size increments, all of them
+		are halved so that old popularity fades.
+		"""
+	def __init__(self, size):
+		width = 16
+		while width < size:
+			width *= 2
+		self.mask = width-1
+		self.width = width
+		self.table = bytearray(4*width)
+		self.added = 0
+		self.reset_at = 10*size
+
+	def _slots(self, key):
+		h = hash(key)
+		m = self.mask
+		w = self.width
+		return (h&m, w+((h*0x9E3779B1>>16)&m), 2*w+((h*0x85EBCA77>>20)&m), 3*w+((h*0xC2B2AE3D>>24)&m))
+
+	def add(self, key):
+		t = self.table
+		for i in self._slots(key):
+			if t[i] < 15:
+				t[i] += 1
+		self.added += 1
+		if self.added >= self.reset_at:
+			self.table = bytearray(t.translate(_halved))
+			self.added //= 2
+
+	def estimate(self, key):
+		t = self.table
+		return min(t[i] for i in self._slots(key))
+
+def _size(v, depth=2):
+	"""Estimate the memory used by a value, looking @depth levels deep"""
+	res = getsizeof(v)
+	if depth:
+		if isinstance(v,dict):
+			for x in v.values():
+				res += _size(x,depth-1)
+		elif isinstance(v,(list,tuple,set,frozenset)):
+			for x in v:
+				res += _size(x,depth-1)
+	return res
+
+def entry_size(value):
+	"""\
+		Estimate the memory used by a cache entry, in bytes.
+
+		Other objects which an entry refers to (e.g. a search's results)
+		are cached separately and thus not counted.
+		"""
+	if isinstance(value,ClientBaseObj):
+		d = value.__dict__
+		res = getsizeof(value)+getsizeof(d)+getsizeof(value._refs)
+		for k,v in d.items():
+			if not k.startswith('_'):
+				res += _size(v,1)
+		return res
+	if isinstance(value,KnownSearch):
+		return getsizeof(value)+_size(value.__dict__,1)
+	if isinstance(value,CacheProxy):
+		return getsizeof(value)+_size(value.data)
+	return _size(value)
+
+def entry_meta(value):
+	"""Return the name of the meta object a cache entry belongs to."""
+	if isinstance(value,KnownSearch):
+		meta = value.kw.get('_obj',None)
+	elif isinstance(value,CacheProxy):
+		meta = value.meta
+	else:
+		meta = getattr(value,'_meta',None)
+	return getattr(meta,'name',None)
+
+class _Segment(OrderedDict):
+	"""An LRU list which knows how much it holds"""
+	used = 0
+
+class TinyLFUCache(CountedCache):
+	"""\
+		An augmented WeakValueDict which keeps up to `size` items pinned,
+		chosen by the W-TinyLFU policy.
+
+		New items go to a small LRU window. Items pushed out of the window
+		enter the main area only if they've been used more often than the
+		items they'd displace, according to a FrequencySketch. The main area
+		is a segmented LRU: items which are used again while on probation
+		are promoted to the protected segment.
+
+		If `memory` is set, the cache keeps items up to that many bytes
+		instead (as estimated by `entry_size` when an item is stored),
+		no matter how many there are.
+
+		Every operation takes constant (amortized) time; nothing is batched.
+		Unpinned items stay available as long as something else refers to
+		them. They are pinned again when they're used.
+		"""
+	def __init__(self,*a,**k):
+		size = max(k.pop('size',CACHE_SIZE),2)
+		memory = k.pop('memory',None)
+		if memory:
+			capacity = memory
+			self.weigh = entry_size
+		else:
+			capacity = size
+			self.weigh = None
+		self.window_size = max(capacity//100,1)
+		self.main_size = capacity-self.window_size
+		self.protected_size = self.main_size*4//5
+
+		self.sketch = FrequencySketch(size)
+		self.weights = {} # key => size, if limited by memory
+		self.window = _Segment()
+		self.probation = _Segment()
+		self.protected = _Segment()
+		super(TinyLFUCache,self).__init__(*a,**k)
+
+	def _put(self, seg, key, value):
+		seg[key] = value
+		seg.used += self.weights.get(key,1)
+
+	def _take(self, seg, key=None):
+		if key is None:
+			key,value = seg.popitem(last=False)
+		else:
+			value = seg.pop(key)
+		seg.used -= self.weights.get(key,1)
+		return key,value
+
+	def _touch(self, key, value):
+		self.sketch.add(key)
+		for seg in (self.window,self.protected):
+			if key in seg:
+				seg[key] = seg.pop(key)
+				return
+		if key in self.probation:
+			self._put(self.protected, *self._take(self.probation,key))
+			self._trim_protected()
+		elif not isinstance(value,AsyncResult):
+			self._admit(key,value)
+
+	def _trim_window(self):
+		while self.window.used > self.window_size:
+			self._admit_main(*self._take(self.window))
+
+	def _trim_protected(self):
+		while self.protected.used > self.protected_size:
+			self._put(self.probation, *self._take(self.protected))
+
+	def _trim_main(self):
+		# Used when an item in the main area grows. There's no newcomer
+		# to compare with, so simply drop the least recently used items.
+		for seg in (self.probation,self.protected):
+			while seg and self.probation.used+self.protected.used > self.main_size:
+				key,value = self._take(seg)
+				self.weights.pop(key,None)
+				self._evicted(key,value)
+
+	def _admit(self, key, value):
+		if self.weigh is not None:
+			self.weights[key] = self.weigh(value)
+		self._put(self.window,key,value)
+		self._trim_window()
+
+	def _admit_main(self, key, value):
+		w = self.weights.get(key,1)
+		if w > self.main_size:
+			# too large to ever fit
+			self.weights.pop(key,None)
+			self._evicted(key,value)
 			return
-		obj._obsolete = True
-		obj._obsoleted()
-		
+		need = self.probation.used+self.protected.used+w-self.main_size
+		if need > 0:
+			# Find the least recently used items which need to go.
+			# Admit the new item only if it's been used more often than
+			# any of them.
+			freq = self.sketch.estimate(key)
+			victims = []
+			for seg in (self.probation,self.protected):
+				for k in seg:
+					if need <= 0:
+						break
+					if self.sketch.estimate(k) >= freq:
+						self.weights.pop(key,None)
+						self._evicted(key,value)
+						return
+					victims.append((seg,k))
+					need -= self.weights.get(k,1)
+			for seg,k in victims:
+				self._evicted(*self._take(seg,k))
+				self.weights.pop(k,None)
+		self._put(self.probation,key,value)
+
+	def _unpin(self, key):
+		for seg in (self.window,self.probation,self.protected):
+			if key in seg:
+				self._take(seg,key)
+				self.weights.pop(key,None)
+				return
+
+	def pinned(self):
+		for seg in (self.window,self.probation,self.protected):
+			for kv in seg.items():
+				yield kv
+
+	def _entry_size(self, key,value):
+		if self.weigh is None:
+			return entry_size(value)
+		return self.weights[key]
+
+	def __getitem__(self, key):
+		res = super(TinyLFUCache,self).__getitem__(key)
+		self._touch(key,res)
+		return res
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def set(self, key,value):
+		"""\
+			Set an item, but do not pin it.
+
+			Used for adding an interim value (AsyncResult while fetching the real thing).
+			"""
+		self._unpin(key)
+		super(TinyLFUCache,self).__setitem__(key,value)
+		return value
+
+	def __setitem__(self, key, value):
+		super(TinyLFUCache,self).__setitem__(key,value)
+		self.sketch.add(key)
+		for seg in (self.window,self.probation,self.protected):
+			if key in seg:
+				self._take(seg,key)
+				if self.weigh is not None:
+					self.weights[key] = self.weigh(value)
+				self._put(seg,key,value)
+				if seg is self.window:
+					self._trim_window()
+				else:
+					self._trim_protected()
+					self._trim_main()
+				return
+		self._admit(key,value)
+
+	def __delitem__(self, key):
+		super(TinyLFUCache,self).__delitem__(key)
+		self._unpin(key)
+
+	def pop(self, key, *default):
+		self._unpin(key)
+		return super(TinyLFUCache,self).pop(key, *default)
+
+caches = {'fifo':CacheDict, 'tinylfu':TinyLFUCache}
+
+class CacheStats(object):
+	"""\
+		Counts cache events by meta object name, operation and event.
+
+		Operations are "get", "find" (also used for "count"), "call"
+		(cached RPC results), and "cache" for the cache itself.
+		Events are "hit", "miss", "wait" (for a running request),
+		"stale" (a call result which is returned while it's refreshed),
+		"evict" and "invalid".
+		"""
+	def __init__(self):
+		self.counts = {}
+
+	def add(self, meta, op, event):
+		k = (getattr(meta,'name',meta),op,event)
+		self.counts[k] = self.counts.get(k,0)+1
+
+	def snapshot(self):
+		"""Return the counters as {meta name: {operation: {event: count}}}."""
+		res = {}
+		for (meta,op,event),n in self.counts.items():
+			res.setdefault(meta,{}).setdefault(op,{})[event] = n
+		return res
+
+	def reset(self):
+		"""Start counting anew. Returns the old counters' snapshot."""
+		res = self.snapshot()
+		self.counts = {}
+		return res
+
+def _value(v):
+	"""Decode a lazy field value"""
+	if v.__class__ is LazyValue:
+		v = v.get()
+	return v
+
+def _field_value(obj, k):
+	"""Decode a lazy field of @obj, and keep the result (like LazyFieldProperty)"""
+	d = obj.__dict__
+	v = d.get(k,None)
+	if v.__class__ is LazyValue:
+		v = d[k] = v.get()
+	return v
 
 class ChangeData(object):
 	"""Some data has been changed locally. Remember which."""
@@ -270,18 +673,23 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 		The basic client implementation.
 		"""
 	root_key = None
-	last_msgid = 0
+	last_msgid = None # not yet known
 	last_msgid_wait = None
+	epoch = None
+	defaults = dict(cache="tinylfu", cache_size=CACHE_SIZE, cache_memory=None, cache_file=None, bootstrap=False, hot=False)
 
 	def __init__(self, cfg={}):
 		global client
 		assert client is None
 
 		self.cfg = default_config.copy()
+		self.cfg.update(self.defaults)
 		self.cfg.update(cfg)
 		self.trace = cfg.get('trace',0)
 
-		self._cache = CacheDict()
+		self.stats = CacheStats()
+		self._cache = self.make_cache()
+		self._cache.stats = self.stats
 		self.codec = self.make_codec()
 		self.transport = self.make_transport()
 
@@ -292,10 +700,152 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 
 	def start(self):
 		self.transport.connect()
+		if self.cfg['cache_file']:
+			self.load_cache()
+		if self.cfg['bootstrap'] and self.root_key is None:
+			self.bootstrap()
+		if self.cfg['hot']:
+			self.fetch_hot()
 	
 	def stop(self):
+		if self.cfg['cache_file']:
+			try:
+				self.save_cache()
+			except Exception:
+				logger.exception("Could not save the cache")
 		self.transport.disconnect()
 
+	def make_cache(self):
+		name = self.cfg['cache']
+		if '.' in name:
+			cls = import_string(name)
+		else:
+			cls = caches[name]
+		return cls(size=self.cfg['cache_size'], memory=self.cfg['cache_memory'])
+
+	def cache_usage(self):
+		"""\
+			Report what the cache holds, by meta object name:
+			{name: {'count':number of items, 'bytes':estimated size}}.
+			"""
+		return self._cache.usage()
+
+	def cache_stats(self, reset=False):
+		"""\
+			Report cache hits, misses, evictions and invalidations:
+			{meta name: {operation: {event: count}}}. See `CacheStats`.
+
+			If @reset is set, start counting anew.
+			"""
+		if reset:
+			return self.stats.reset()
+		return self.stats.snapshot()
+
+	def cache_hot(self, n=10):
+		"""Return the @n most-used cache entries, as (value,counter) pairs."""
+		return self._cache.hot(n)
+
+	def _file_codec(self):
+		"""The codec for `cache_file`: marshal, with our adapters."""
+		res = import_string("dabroker.base.codec.marshal.Codec")(loader=self, cfg={'codec_oob_min':0})
+		for k,v in self.codec.type2cls.items():
+			res.type2cls[k] = v
+		res.name2cls.update(self.codec.name2cls)
+		return res
+
+	def save_cache(self):
+		"""\
+			Store the cached objects in `cache_file`, so that `load_cache`
+			can re-use them.
+
+			Objects which have been changed locally, search results and
+			RPC results are not stored.
+			"""
+		if self.epoch is None:
+			# The server never told us; we couldn't check the data.
+			return
+		codec = self._file_codec()
+		rows = []
+		with self.env:
+			for key,obj in list(self._cache.items()):
+				if not isinstance(obj,ClientBaseObj) or obj is client_broker_info_meta:
+					continue
+				if obj._obsolete or key in self.obj_chg or key.code is None:
+					continue
+				meta = obj._meta
+				names = list(meta.fields)
+				if isinstance(obj,ClientBrokeredInfo):
+					kind = META
+					names.extend((n[5:] if n.startswith('_dab_') else n) for n,f in obj.fields.items() if getattr(f,'for_class',False))
+				elif key == self.root_key:
+					kind = ROOT
+				else:
+					kind = OBJ
+				d = obj.__dict__
+				f = dict((n,_field_value(obj,n)) for n in names if n in d)
+				r = dict((n,v) for n,v in obj._refs.items() if n in meta.refs)
+				r['_meta'] = meta
+				try:
+					rows.append((kind, codec.encode({'k':key.key,'c':key.code,'f':f,'r':r})))
+				except Exception:
+					logger.debug("Not saved: %r",obj, exc_info=True)
+
+		cf = CacheFile(self.cfg['cache_file'])
+		try:
+			cf.save({'epoch':self.epoch, 'msgid':self.last_msgid or 0}, rows)
+		finally:
+			cf.close()
+
+	def load_cache(self):
+		"""\
+			Load the objects which `save_cache` stored, then ask the server
+			which of them have changed since. These are updated (or
+			dropped, if they no longer exist) in a single round trip.
+
+			If there is no usable file, this still asks the server for its
+			epoch, which `save_cache` needs.
+			"""
+		codec = self._file_codec()
+		objs = []
+		cf = CacheFile(self.cfg['cache_file'])
+		try:
+			info = cf.info()
+			with self.env:
+				for kind,data in (cf.load() if info else ()):
+					try:
+						d = codec.decode2(codec.decode(data))
+						if kind == META:
+							obj = client_InfoObj.decode(**d)
+						else:
+							obj = client_BaseObj.decode(**d)
+					except Exception:
+						logger.debug("Not loaded: %r",data, exc_info=True)
+						continue
+					objs.append(obj)
+					if kind == ROOT:
+						self.root_key = obj._key
+		finally:
+			cf.close()
+
+		try:
+			res = self.send("cache_check", epoch=info.get('epoch',None), msgid=info.get('msgid',0),
+				keys=[(obj._key.key,obj._key.code) for obj in objs])
+		except Exception:
+			# We can't tell whether the data are current, so drop them.
+			logger.exception("Could not check the cache")
+			self.root_key = None
+			for obj in objs:
+				self._cache.pop(obj._key,None)
+			return
+		# Changed objects have been updated by decoding the reply.
+		with self.env:
+			for k in res['d']:
+				key = ClientBaseRef(key=tuple(k))
+				if key == self.root_key:
+					self.root_key = None
+				self._cache.invalidate(key)
+		self.epoch = res['e']
+
 	def make_transport(self):
 		name = self.cfg['transport']
 		if '.' not in name:
@@ -325,48 +875,62 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			if old is obj:
 				return
 
-		if old is None:
+		if old is None or isinstance(old,Missing):
 			self._cache[key] = obj
 		elif isinstance(old,AsyncResult):
 			self._cache[key] = obj
 			old.set(obj)
 		else:
-			# We get an object we already have. Locally modified?
-			chg = self.obj_chg.get(key,None)
-			if chg is not None:
-				# Ugh. Yes.
-				upd = {}
-				coll = {}
-				for k in obj._meta.fields:
-					sv = getattr(obj,k) # new from server
-					cv = old.__dict__.get(k,None) # new on the client
-					ov = chg.old_data.get(k,cv) # our old value
-					if cv == sv:
-						# server has our current value, so drop that change
-						chg.old_data.pop(k,None)
-						continue
-					if ov == sv:
-						# server didn' yet see our change, nothing to do
-						continue
-					if cv != ov:
-						# three-way difference: inconsistent values
-						coll[k] = (ov,cv,sv)
-						continue
-					upd[k] =  sv
-				if coll:
-					self.obj_chg[key] = ChangeInvalid(self,obj,coll)
-					return old
-				# 
-				old.__dict__.update(upd)
-				if not chg.old_data:
-					# all our updates have arrived on the server
-					del self.obj_chg[key]
-			else:
-				old.__dict__.update(obj.__dict__)
-			return old
+			# We get an object we already have.
+			return self._update_cached(old, obj.__dict__)
 		obj._dab = self
 		return obj
 
+	def _update_cached(self, old, fields, refs=None):
+		"""\
+			Update @old, which is in the cache, with the @fields (and
+			@refs) the server sent. Returns @old.
+
+			If the object has been modified locally, only fields which
+			do not conflict are updated.
+			"""
+		key = old._key
+		chg = self.obj_chg.get(key,None)
+		if chg is not None:
+			# Ugh. Yes.
+			upd = {}
+			coll = {}
+			for k in old._meta.fields:
+				sv = _value(fields.get(k,None)) # new from server
+				cv = _field_value(old,k) # new on the client
+				ov = chg.old_data.get(k,cv) # our old value
+				if cv == sv:
+					# server has our current value, so drop that change
+					chg.old_data.pop(k,None)
+					continue
+				if ov == sv:
+					# server didn' yet see our change, nothing to do
+					continue
+				if cv != ov:
+					# three-way difference: inconsistent values
+					coll[k] = (ov,cv,sv)
+					continue
+				upd[k] =  sv
+			if coll:
+				self.obj_chg[key] = ChangeInvalid(self,old,coll)
+				return old
+			# 
+			old.__dict__.update(upd)
+			if not chg.old_data:
+				# all our updates have arrived on the server
+				del self.obj_chg[key]
+		else:
+			old.__dict__.update(fields)
+			if refs is not None:
+				old._refs.update(refs)
+				old._call_cache.clear()
+		return old
+
 	def get(self, key):
 		"""Get an object, from cache or from the server."""
 
@@ -381,6 +945,14 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 		if obj is not None:
 			if isinstance(obj,AsyncResult):
 				obj = obj.get(timeout=RETR_TIMEOUT)
+				self.stats.add(obj._meta,"get","wait")
+			elif isinstance(obj,Missing):
+				self.stats.add(obj._meta,"get","hit")
+				err = obj.error
+				err.__traceback__ = None # don't accumulate
+				raise err
+			else:
+				self.stats.add(obj._meta,"get","hit")
 			return obj
 
 		# Step 3: Get it from the network.
@@ -393,17 +965,23 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			# Owch.
 			# Remove the AsyncResult from cache, and forward the exception to any waiters
 			arx = self._cache.pop(key)
-			logger.exception("Ouch %r %r",ar,arx)
+			if not isinstance(e,NoData):
+				logger.exception("Ouch %r %r",ar,arx)
 			assert ar is arx, (ar,arx)
 			ar.set_exception(e)
 			# As `ar` is unused beyond this point, its value might already
 			# gone from the cache (weak reference!) if we just use the
 			# return value of ._cache_pop()
+			if isinstance(e,NoData):
+				meta = getattr(key,'meta',None)
+				self.stats.add(meta,"get","miss")
+				self._cache[key] = Missing(e, meta)
 			raise
 		else:
 			# The deserializer has already added the object to the cache (or it should have)
 			cobj = self._cache.get(key,None)
 			assert cobj is obj, (cobj,obj,key)
+			self.stats.add(obj._meta,"get","miss")
 			return obj
 		
 	def obj_new(self,cls,**kw):
@@ -447,52 +1025,160 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 		chg = self.obj_chg; self.obj_chg = {}
 		self._rollback(chg)
 	
-	def find(self, typ, _cached=False,_limit=None, **kw):
-		"""Find objects by keyword"""
+	def find(self, typ, _cached=False,_limit=None,_stream=False,_columns=False, **kw):
+		"""\
+			Find objects by keyword.
+
+			@_stream: return an iterator which decodes the results as
+			          they are requested, instead of a list.
+
+			@_columns: ask the server to send the result column by column.
+			           The result is a ColumnResult; its `columns`
+			           attribute holds the field values as arrays.
+			"""
 		assert getattr(typ.calls.get('_dab_search',None),'for_class',False)
+		if _columns:
+			# part of the search key; the result is lazy anyway
+			kw['_columns'] = True
+			_stream = False
 		
+		kws = None
 		if _cached:
 			kws = search_key(None,**kw)
 			ks = typ.searches.get(kws,None)
 			if ks is not None and (not ks.limit or (_limit and _limit <= len(ks.res))):
+				self.stats.add(typ,"find","hit")
 				self._cache[ks.ckey] # update the access counter
 				if _limit:
 					return ks.res[:_limit]
 				else:
 					return ks.res
+			if not _columns:
+				res = self._find_contained(typ,kw)
+				if res is not None:
+					self.stats.add(typ,"find","hit")
+					self._add_search(typ,kws,dict(kw,_obj=typ),res,None)
+					if _limit:
+						return res[:_limit]
+					return res
 		
 		kw['_obj'] = typ
 		if _limit is not None:
 			kw['_limit'] = _limit
+		if _stream:
+			kw['_stream'] = True
 		res = self.send("_dab_search", **kw)
 
 		if _cached:
-			ckey = " ".join(str(x) for x in typ._key.key)+":"+kws
+			self.stats.add(typ,"find","miss")
+			if _stream:
+				return self._find_stream(typ,kws,kw,res,_limit)
+			self._add_search(typ,kws,kw,res,_limit)
+		return res
 
-			if _limit and len(res) < _limit:
-				_limit = None
-			ks = KnownSearch(kw,res,ckey, _limit)
-			typ.searches[kws] = ks
-			self._cache[ckey] = ks
+	def _find_stream(self, typ,kws,kw,res,limit):
+		"""Pass search results through, and cache the search when complete"""
+		done = []
+		for r in res:
+			done.append(r)
+			yield r
+		self._add_search(typ,kws,kw,done,limit)
 
+	def _find_contained(self, typ,kw):
+		"""\
+			Answer a search for @kw from a cached complete search which
+			includes its results, by checking the remaining keywords
+			against the objects' fields. Returns None if there's no such
+			search, if a keyword isn't a field or reference, or if the
+			search returned references to objects which aren't cached.
+			"""
+		best = None
+		for ks in typ.searches.containing(kw):
+			if best is None or len(ks.res) < len(best.res):
+				best = ks
+		if best is None:
+			return None
+		check = [(k,v) for k,v in kw.items() if k not in best.kw]
+		for k,v in check:
+			if k not in typ.fields and k not in typ.refs:
+				return None
+		objs = []
+		for obj in best.res:
+			if not isinstance(obj,ClientBaseObj):
+				# The server sent a reference. Fetching the objects
+				# would cost more than asking the server.
+				obj = self._cache.get(obj,None)
+				if not isinstance(obj,ClientBaseObj):
+					return None
+			objs.append(obj)
+		self._cache[best.ckey] # update the access counter
+
+		res = []
+		for obj in objs:
+			if obj._obsolete:
+				# changed since; the change didn't affect the search
+				try:
+					obj = self.get(obj._key)
+				except NoData:
+					continue
+			for k,v in check:
+				if k in typ.refs:
+					r = obj._refs.get(k,None)
+					if r is None:
+						if v is not None:
+							break
+					elif r != v:
+						break
+				elif getattr(obj,k) != v:
+					break
+			else:
+				res.append(obj)
 		return res
 
+	def _add_search(self, typ,kws,kw,res,limit):
+		ckey = " ".join(str(x) for x in typ._key.key)+":"+kws
+
+		if limit and len(res) < limit:
+			limit = None
+		ks = KnownSearch(kw,res,ckey, limit)
+		typ.searches[kws] = ks
+		self._cache[ckey] = ks
+
 	def count(self, typ, _cached=False, **kw):
 		"""Count objects"""
-		call = typ._meta.calls['_dab_count']
+		assert getattr(typ.calls.get('_dab_count',None),'for_class',False)
 		if _cached:
 			kws = search_key(None,_c='count',**kw)
 			ks = typ.searches.get(kws,None)
 			if ks is not None:
+				self.stats.add(typ,"count","hit")
 				self._cache[ks.ckey] # update the access counter
 				return ks.res
-		
-		kw['_obj'] = typ
-		res = self.send("_dab_count", **kw)
+
+			# A complete search result tells us, too.
+			ks = typ.searches.get(search_key(None,**kw),None)
+			if ks is not None and not ks.limit:
+				res = len(ks.res)
+				self._cache[ks.ckey] # update the access counter
+			else:
+				res = self._find_contained(typ,kw)
+				if res is not None:
+					res = len(res)
+			if res is not None:
+				self.stats.add(typ,"count","hit")
+		else:
+			res = None
+
+		if res is None:
+			kw['_obj'] = typ
+			res = self.send("_dab_count", **kw)
+			if _cached:
+				self.stats.add(typ,"count","miss")
 
 		if _cached:
+			kw['_obj'] = typ
 			ckey = " ".join(str(x) for x in typ._key.key)+":"+kws
-			ks = KnownSearch(kw,res,ckey)
+			ks = KnownSearch(kw,res,ckey, count=True)
 			typ.searches[kws] = ks
 			self._cache[ckey] = ks
 		return res
@@ -518,6 +1204,21 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			_obj = _obj._key
 		_obj.send(_sig,**data)
 
+	def do_hot(self,*keys):
+		"""\
+			The server has added these objects to its hot set. Fetch the
+			set if we don't have them.
+
+			The reply to a call waits until this broadcast has been
+			processed, so the fetch runs in a new thread.
+			"""
+		if not self.cfg['hot']:
+			return
+		for k in keys:
+			if k not in self._cache:
+				self._fetch_hot()
+				return
+
 	def do_invalid(self,*keys):
 		"""Directly invalidate these cache entries."""
 		for k in keys:
@@ -529,7 +1230,8 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 	def do_invalid_key(self,_key=None,_meta=None, **k):
 		"""Invalidate an object, plus whatever might have been used to search for it.
 		
-			@key the updated/deleted object (or None if the object is new)
+			@key the created, updated or deleted object. For a new object,
+			     this drops the note that it didn't exist (see `Missing`).
 			@meta the object's metadata key (search results hang off metadata)
 			@k: a key=>(value,…) dict. A search is obsoleted when one
 									   of the search keys matches one of the values.
@@ -551,34 +1253,10 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			#logger.debug("inval_key: wait for %r: got %r",_meta,obj)
 		#logger.warn("inval start %s %s",obj,k)
 
-		obsolete = set()
-
-		# What this does: a search checks a number of keys for specific
-		# values. So the search is affected when all of these values 
-		# match our update set.
-		# A search is also affected when none of the values match, but only
-		# if it's not an update.
-		# TODO: This loop is somewhat inefficient.
-		for ks,s in obj.searches.items():
-			#logger.warn("Scanning %s %s",ks,s)
-			keymatches = False
-			mismatches = False
-			is_update = False
-			for i,v in k.items():
-				if len(v) > 1:
-					is_update = True
-				sv = s.kw.get(i,_NotGiven)
-				if sv is _NotGiven:
-					continue
-				keymatches = True
-				if sv not in v:
-					mismatches = True
-					break
-			if not mismatches if keymatches else not is_update:
-				obsolete.add(ks)
-		for ks in obsolete:
+		for ks in obj.searches.affected(k):
 			#logger.debug("dropping %s",ks)
 			obj.searches.pop(ks,None)
+			self.stats.add(obj,"find","invalid")
 		#logger.warn("inval done %s",obj)
 
 	@property
@@ -603,9 +1281,39 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 		rk.set(obj)
 		return obj
 
+	def bootstrap(self):
+		"""\
+			Get the object root and all meta objects in a single call,
+			instead of fetching each meta object when it's first used.
+			Returns the root.
+			"""
+		res = self.send("bootstrap")
+		obj = res[-1]
+		self.root_key = getattr(obj,"_key",None)
+		if self.root_key is not None:
+			self._add_to_cache(obj)
+		return obj
+
+	def fetch_hot(self):
+		"""\
+			Fetch the server's hot set (the objects which most clients
+			use) with a single call, and add them to the cache.
+			Returns the objects, preceded by their meta objects.
+			"""
+		return self.send("hot")
+
+	@spawned
+	def _fetch_hot(self):
+		with self.env:
+			try:
+				self.fetch_hot()
+			except Exception:
+				logger.exception("Could not fetch the hot set")
+
 	def send(self, action, *a,**kw):
 		"""Generic method for RPCing the server"""
 		_obj = kw.pop('_obj',None)
+		_stream = kw.pop('_stream',False)
 		#logger.debug("send %s %r %r %r",action,_obj,a,kw)
 		assert '_a' not in kw
 		assert '_m' not in kw
@@ -616,12 +1324,16 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			kw['_o'] = _obj
 		if a:
 			kw['_a'] = a
-		msg = self._send(kw)
+		msg = self._send(kw, _stream=_stream)
 		#logger.debug("recv %r",msg)
 		return msg
 	
-	def _send(self,msg):
-		"""Low-level message sender"""
+	def _send(self,msg, _stream=False):
+		"""\
+			Low-level message sender.
+
+			@_stream: return an iterator, see BaseCodec.decode2_iter.
+			"""
 		with self.env:
 			#logger.debug("Send req: %r",msg)
 			msg = self.codec.encode(msg)
@@ -629,6 +1341,9 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 			msg = self.codec.decode(msg)
 			if hasattr(msg,'msgid'):
 				msgid = msg.msgid
+				if self.last_msgid is None:
+					# Our first reply. Earlier broadcasts don't matter.
+					self.last_msgid = msgid
 				while self.last_msgid < msgid:
 					if self.trace:
 						logger.debug("Waiting %d %d",self.last_msgid,msgid)
@@ -639,9 +1354,22 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 						break
 
 			#logger.debug("Recv reply: %r",msg)
+			if _stream:
+				return self._recv_iter(msg)
 			msg = self.codec.decode2(msg)
 			return msg
 
+	def _recv_iter(self,msg):
+		# Do not keep the environment while the caller has control.
+		msg = self.codec.decode2_iter(msg)
+		while True:
+			with self.env:
+				try:
+					res = next(msg)
+				except StopIteration:
+					return
+			yield res
+
 	@spawned
 	def recv(self, msg):
 		"""Process incoming notifications from the server"""
@@ -667,7 +1395,7 @@ class BrokerClient(BrokerEnv, BaseCallbacks):
 
 			if self.trace:
 				logger.debug("LastID %s %s",self.last_msgid,msgid)
-			if msgid and self.last_msgid < msgid:
+			if msgid and (self.last_msgid is None or self.last_msgid < msgid):
 				self.last_msgid = msgid
 				x,self.last_msgid_wait = self.last_msgid_wait,None
 				if x is not None:
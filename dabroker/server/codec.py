@@ -13,11 +13,14 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 ##BP
 
 from ..base import BaseRef,BaseObj,BrokeredInfo,BrokeredInfoInfo, adapters as baseAdapters, common_BaseObj,common_BaseRef
+from ..base.codec import array_type
 from ..base.config import default_config
 from ..base.service import current_service
 from hashlib import sha1 as mac
 from base64 import b64encode
 from six import integer_types
+from array import array
+import datetime as dt
 
 # This is the server's storage side.
 
@@ -45,15 +48,33 @@ def codec_adapter(cls):
 	adapters.append(cls)
 	return cls
 
+def _compact():
+	"""Check whether the current server wants compact object encoding."""
+	srv = current_service.top
+	return srv is not None and srv.codec.cfg['codec_compact']
+
 @codec_adapter
 class server_BaseObj(common_BaseObj):
 	@staticmethod
-	def encode(obj, include=False):
+	def encode(obj, include=False, compact=None):
 		if obj._key.code is None:
 			obj._key.code = make_secret(obj._key.key)
 		if not include:
 			return common_BaseRef.encode(obj._key, meta=obj._meta)
-		return common_BaseObj.encode(obj, include=include)
+
+		# The meta object knows how to extract the data.
+		res = common_BaseRef.encode(obj._key)[1]
+		meta = obj._meta
+		if compact is None:
+			compact = _compact()
+		if compact:
+			# The client has (or fetches) the meta object, so it
+			# knows the field names.
+			res['r'] = {'_meta':meta._key}
+			res['v'] = meta.obj_encoder(True)(obj)
+		else:
+			res['f'],res['r'] = meta.obj_encoder()(obj)
+		return res
 
 	@staticmethod
 	def decode(k=None,c=None,f=None,r=None):
@@ -68,6 +89,73 @@ class server_BaseObj(common_BaseObj):
 					raise NotImplementedError("Update: {} {} {} {}".format(res,k,getattr(res,k),v))
 		return res
 
+class Columns(object):
+	"""\
+		A search result, to be sent column by column.
+		All objects need to have the same meta object.
+
+		The client decodes this as a dabroker.client.codec.ColumnResult.
+		"""
+	def __init__(self, meta, objs):
+		self.meta = meta
+		self.objs = objs
+
+_int_type = array_type('q')
+def _pack_column(col):
+	"""\
+		Pack a column of integers, floats or dates into an array.
+		Dates are stored as ordinals.
+		Returns the column and a flag whether it contains dates.
+		"""
+	types = set(type(v) for v in col)
+	if len(types) == 1:
+		t = types.pop()
+		try:
+			if t in integer_types:
+				return array(_int_type,col),False
+			if t is float:
+				return array(str('d'),col),False
+			if t is dt.date:
+				return array(_int_type,(v.toordinal() for v in col)),True
+		except OverflowError:
+			pass
+	return list(col),False
+
+@codec_adapter
+class server_Columns(object):
+	cls = Columns
+	clsname = "Cols"
+
+	@staticmethod
+	def encode(obj, include=False):
+		meta = obj.meta
+		fields,refs,sig = meta.layout()
+		enc = meta.obj_encoder(True)
+		keys = []
+		codes = []
+		rows = []
+		for o in obj.objs:
+			k = o._key
+			if k.code is None:
+				k.code = make_secret(k.key)
+			keys.append(k.key)
+			codes.append(k.code)
+			rows.append(enc(o))
+		if rows:
+			cols = list(zip(*rows))[1:]
+		else:
+			cols = [()]*(len(fields)+len(refs))
+
+		f = []
+		dates = []
+		for i,col in enumerate(cols[:len(fields)]):
+			col,is_date = _pack_column(col)
+			f.append(col)
+			if is_date:
+				dates.append(i)
+		r = [list(col) for col in cols[len(fields):]]
+		return {'m':meta._key, 's':sig, 'k':keys, 'c':codes, 'f':f, 'r':r, 'd':dates}
+
 @codec_adapter
 class server_BaseRef(common_BaseRef):
 	cls = BaseRef
@@ -99,7 +187,7 @@ class server_InfoObj(server_BaseObj):
 	def encode(obj, include=False):
 		if not include:
 			return common_BaseRef.encode(obj._key, meta=obj._meta)
-		res = server_BaseObj.encode(obj, include=include)
+		res = server_BaseObj.encode(obj, include=include, compact=False)
 		for n,f in obj.fields.items():
 			if n.startswith('_dab_'):
 				rn = n[5:]
@@ -14,7 +14,7 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 
 # Object loaders. The static loader is defined here.
 
-from ...base import broker_info_meta, BaseObj,BaseRef
+from ...base import broker_info_meta, BaseObj,BaseRef,BrokeredInfo
 
 class Loaders(object):
 	"""\
@@ -61,6 +61,25 @@ class Loaders(object):
 			assert obj._key == key, (obj._key,key)
 		return obj
 
+	def metas(self):
+		"""\
+			Return all exported meta objects.
+
+			A meta object's own meta object, unless it's the root
+			`broker_info_meta`, is listed before it.
+			"""
+		def depth(m):
+			d = 0
+			while m._meta is not broker_info_meta:
+				m = m._meta
+				d += 1
+			return d
+		res = []
+		for loader in self.loaders.values():
+			res.extend(loader.metas())
+		res.sort(key=depth)
+		return res
+
 	def delete(self,*key):
 		"""\
 			Remove an object.
@@ -96,6 +115,10 @@ class BaseLoader(object):
 	def get(self,*key):
 		raise NotImplementedError("You need to override {}.get()".format(self.__class__.__name__))
 
+	def metas(self):
+		"""The meta objects this loader serves"""
+		return ()
+
 	def update(self, obj, **kv):
 		"""Update an object. You might want to override this."""
 		for k,v in kv.items():
@@ -140,6 +163,9 @@ class StaticLoader(BaseLoader):
 	def get(self,*key):
 		return self.objects[key]
 
+	def metas(self):
+		return [obj for obj in self.objects.values() if isinstance(obj,BrokeredInfo) and obj is not broker_info_meta]
+
 	def delete(self,*key):
 		del self.objects[key]
 
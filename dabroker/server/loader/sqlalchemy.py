@@ -237,6 +237,9 @@ class SQLLoader(BaseLoader):
 			return m
 		return m.get(*key[1:])
 
+	def metas(self):
+		return list(self.meta.values())+list(self.tables.values())
+
 	def add(self, obj, *key):
 		# dummy, .get already knows me
 		assert len(key) == 1 and key[0] == obj.name, (key,obj,obj.name)
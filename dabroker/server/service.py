@@ -16,14 +16,16 @@ from __future__ import absolute_import, print_function, division, unicode_litera
 
 from .loader import Loaders
 from . import ServerBrokeredInfo,ServerBrokeredMeta
-from ..base import UnknownCommandError,BaseRef, Field,Ref,BackRef,Callable, broker_info_meta,_Attribute
+from ..base import UnknownCommandError,NoData,BaseRef, Field,Ref,BackRef,Callable, broker_info_meta,_Attribute
 from ..util import import_string,_ClassMethodType
 from ..base.config import default_config
 from ..base.transport import BaseCallbacks
 from ..base.service import BrokerEnv
-from .codec import adapters as default_adapters
+from .codec import adapters as default_adapters, Columns, make_secret
 
 import sys
+from uuid import uuid4
+from collections import deque, OrderedDict
 from traceback import format_exc
 from itertools import chain
 from six import string_types
@@ -42,6 +44,7 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 	root = None
 	transport = None
 	last_msgid = 0
+	defaults = dict(cache_log=10000)
 
 	def __init__(self, cfg={}, loader=None, adapters=()):
 		# the sender might be set later
@@ -49,6 +52,18 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 		self.cfg = cfg
 		for k,v in default_config.items():
 			self.cfg.setdefault(k,v)
+		for k,v in self.defaults.items():
+			self.cfg.setdefault(k,v)
+
+		# Clients which stored their cache ask which objects have been
+		# invalidated since. We remember that (up to a point) for as long
+		# as this server runs, i.e. for this epoch.
+		self.epoch = uuid4().hex
+		self.inval_log = deque(maxlen=self.cfg['cache_log']) # (msgid,key)
+		self.inval_start = 0 # the log is incomplete before that
+
+		# Objects which clients should fetch when they start, see add_hot()
+		self.hot = OrderedDict() # key tuple => BaseRef
 
 		if loader is None:
 			loader = Loaders(server=self)
@@ -137,6 +152,38 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 		return res
 	do_root._dab_include = True
 
+	def do_bootstrap(self):
+		"""\
+			Return all meta objects, followed by the root, so that a new
+			client doesn't need to fetch them one by one.
+			"""
+		res = self.do_root()
+		return self.loader.metas()+[res]
+	do_bootstrap._dab_include = True
+
+	def do_hot(self):
+		"""\
+			Return the objects in the hot set, see `add_hot`. Their meta
+			objects are listed first (unless they're well-known), so that a
+			client doesn't need to fetch them one by one.
+			"""
+		objs = []
+		for k,ref in list(self.hot.items()):
+			try:
+				objs.append(self.get(ref))
+			except (KeyError,NoData):
+				del self.hot[k]
+
+		need = set()
+		for obj in objs:
+			m = obj._meta
+			while m is not broker_info_meta and id(m) not in need:
+				need.add(id(m))
+				m = m._meta
+		metas = [m for m in self.loader.metas() if id(m) in need]
+		return metas+objs
+	do_hot._dab_include = True
+
 	def do_echo(self,msg):
 		logger.debug("echo %r",msg)
 		return msg
@@ -156,6 +203,35 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 		return obj
 	do_get._dab_include = True
 
+	def do_cache_check(self, epoch=None, msgid=0, keys=()):
+		"""\
+			A client has stored these objects, a list of (key,code) pairs.
+			They were current as of broadcast @msgid in @epoch. Reply with
+			the current version of those which have changed since, and the
+			keys of those which no longer exist.
+
+			If the epoch doesn't match, or the invalidation log doesn't
+			reach back that far, all of them may have changed.
+			"""
+		if epoch == self.epoch and msgid >= self.inval_start:
+			changed = set(k for m,k in self.inval_log if m > msgid)
+		else:
+			changed = None
+		objs = []
+		gone = []
+		for k,c in keys:
+			k = tuple(k)
+			if changed is not None and k not in changed:
+				continue
+			try:
+				if c != make_secret(k):
+					raise KeyError(k)
+				objs.append(self.get(BaseRef(key=k,code=c)))
+			except (KeyError,NoData):
+				gone.append(k)
+		return {'e':self.epoch, 'o':objs, 'd':gone}
+	do_cache_check._dab_include = True
+
 	def do_update(self,obj,k={}):
 		"""Update an object.
 		
@@ -188,7 +264,8 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 	def send_created(self, obj, attrs={}):
 		"""This object has been created."""
 		attrs = dict((k,(v,)) for k,v in attrs.items())
-		self.send("invalid_key", _meta=obj._meta._key, _include=None, **attrs)
+		# The key drops a client's note that the object doesn't exist.
+		self.send("invalid_key", _key=obj._key, _meta=obj._meta._key, _include=None, **attrs)
 
 	def send_deleted(self, obj, attrs={}):
 		"""This object has been deleted."""
@@ -224,6 +301,7 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 	def recv(self, msg):
 		"""Receive a message. Usually called as a separate thread."""
 		incl = False
+		cols = False
 		with self.env:
 			#logger.debug("recv raw %r",msg)
 
@@ -246,8 +324,10 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 						else:
 							c = o._meta.calls[m]
 							assert not getattr(c,'for_class',False)
-						if m == "_dab_search" and getattr(o,'_dab_cached',None) is not None:
-							incl = msg.get('_limit',99) < 10
+						if m == "_dab_search":
+							cols = msg.pop('_columns',False)
+							if getattr(o,'_dab_cached',None) is not None:
+								incl = msg.get('_limit',99) < 10
 						if hasattr(o,m):
 							do = o
 						else:
@@ -261,6 +341,8 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 					raise
 					raise UnknownCommandError((m,o,a))
 				msg = proc(*a,**msg)
+				if cols and all(r._meta is o for r in msg):
+					msg = Columns(o,msg)
 				#logger.debug("reply %r",msg)
 				try:
 					msg = self.codec.encode(msg, _include = getattr(proc,'_dab_include',incl), msgid=self.last_msgid)
@@ -273,6 +355,40 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 			except BaseException as e:
 				return self.codec.encode_error(e, sys.exc_info()[2])
 
+	def _log_invalid(self, msgid, key):
+		"""Remember that this object changed, for `do_cache_check`"""
+		if key is None:
+			return
+		if isinstance(key,BaseRef):
+			key = key.key
+		log = self.inval_log
+		if len(log) == log.maxlen:
+			self.inval_start = log[0][0] if log else msgid
+		log.append((msgid,tuple(key)))
+
+	def add_hot(self, *objs):
+		"""\
+			Add these objects to the hot set: objects which most clients
+			will use, so they should fetch them in bulk when they start
+			(see the client's `hot` option).
+
+			Clients which are already running are told about the new
+			objects.
+			"""
+		keys = []
+		for obj in objs:
+			k = obj._key
+			if k.key not in self.hot:
+				self.hot[k.key] = k
+				keys.append(k)
+		if keys and self.transport is not None:
+			self.send("hot", *keys, _include=None)
+
+	def drop_hot(self, *objs):
+		"""Remove these objects from the hot set."""
+		for obj in objs:
+			self.hot.pop(obj._key.key, None)
+
 	def send(self, action, *a, **k):
 		"""Broadcast a message to all clients"""
 		with self.env:
@@ -285,6 +401,11 @@ class BrokerServer(BrokerEnv, BaseCallbacks):
 
 			msgid = self.last_msgid+1
 			self.last_msgid = msgid
+			if action == "invalid_key":
+				self._log_invalid(msgid, k.get('_key',None))
+			elif action == "invalid":
+				for key in a:
+					self._log_invalid(msgid, key)
 			msg = self.codec.encode(msg, include=include, msgid=msgid)
 			self.transport.send(msg)
 
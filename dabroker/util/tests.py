@@ -63,6 +63,9 @@ test_cfg = dict(
                 amqp_user='test', amqp_password='test', amqp_host=os.environ.get('AMQP_HOST','127.0.0.1'),
 				amqp_virtual_host='/test',
                 codec=os.environ.get("DAB_CODEC","null"),
+                codec_compact=(os.environ.get("DAB_COMPACT","0") == "1"),
+                codec_intern=(os.environ.get("DAB_INTERN","0") == "1"),
+                codec_lazy=(os.environ.get("DAB_LAZY","0") == "1"),
 )
 
 test_cfg_local = cfg_merge(test_cfg, transport="local")
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This is not a test. It times the codecs on a couple of typical
+# messages, so that you can check whether a change makes things faster
+# or slower. No server or AMQP broker is required.
+#
+#	python tests/bench_codec.py -o before.json
+#	… change something …
+#	python tests/bench_codec.py -C before.json
+#
+# For each codec and payload, "encode" is the time to go from Python
+# objects to the wire, "decode" the time to unpack the wire format, and
+# "decode2" the time to re-create the objects. Allocations are only
+# measured on Python 3 (they need tracemalloc); they do not include the
+# timing runs.
+
+from dabroker import __VERSION__
+from dabroker.base import BaseObj,BaseRef,BrokeredInfo, Field,Ref,Callable
+from dabroker.base.codec import BaseCodec,WireMessage
+from dabroker.server.codec import adapters as server_adapters, Columns
+from dabroker.util import import_string
+
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+import datetime as dt
+import json
+import sys
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+CODECS = ("null","json","marshal","bson","msgpack")
+
+## Payloads
+
+def _key(*k):
+	return BaseRef(key=k)
+
+def _person_meta():
+	meta = BrokeredInfo("Person")
+	for f in ("id","name","email","active","score","born"):
+		meta.add(Field(f))
+	meta.add(Ref("dept"))
+	meta._key = _key("static","person")
+	return meta
+
+class Person(BaseObj):
+	_meta = _person_meta()
+
+def _people(n):
+	dept = BaseObj()
+	dept._key = _key("dept",1)
+	res = []
+	for i in range(n):
+		p = Person()
+		p._key = _key("person",i)
+		p.id = i
+		p.name = "Person %d" % i
+		p.email = "person%d@example.com" % i
+		p.active = bool(i%3)
+		p.score = i/7
+		p.born = dt.date(1950,1,1)+dt.timedelta(i%20000)
+		p.dept = dept
+		res.append(p)
+	return res
+
+def meta_objects():
+	"""50 metadata objects, as sent when a client starts up"""
+	res = []
+	for i in range(50):
+		m = BrokeredInfo("Table%d" % i)
+		for j in range(12):
+			m.add(Field("field%d" % j))
+		for j in range(3):
+			m.add(Ref("ref%d" % j))
+		for j in range(4):
+			m.add(Callable("call%d" % j))
+		m._key = _key("static","table",i)
+		res.append(m)
+	return res,True
+
+def search_result():
+	"""10000 objects, as returned by `find`"""
+	return _people(10000),True
+
+def search_columns():
+	"""The same, as a columnar result"""
+	return Columns(Person._meta,_people(10000)),True
+
+def nested():
+	"""dicts nested 100 levels deep"""
+	res = top = {}
+	for i in range(100):
+		res['n'] = [i,{'i':str(i)}]
+		res = res['n'][1]
+	return top,False
+
+def shared():
+	"""A tree of 5000 nodes which refer to their parents"""
+	root = {'name':"root", 'children':[], 'parent':None}
+	nodes = [root]
+	for i in range(1,5000):
+		parent = nodes[(i-1)//4]
+		node = {'name':"node %d" % i, 'children':[], 'parent':parent}
+		parent['children'].append(node)
+		nodes.append(node)
+	return root,False
+
+def dates():
+	"""10000 rows with date and time values"""
+	base = dt.datetime(2014,7,4,12,34,56)
+	res = []
+	for i in range(10000):
+		t = base+dt.timedelta(0,i*97)
+		res.append({'id':i, 'when':t, 'day':t.date(), 'at':t.time(), 'took':dt.timedelta(0,i)})
+	return res,False
+
+PAYLOADS = dict((p.__name__,p) for p in (meta_objects,search_result,search_columns,nested,shared,dates))
+
+## The decoder side
+
+def _echo(name):
+	class echo(object):
+		"""Decode an object to its arguments, so that we time just the codec"""
+		cls = None
+		clsname = name
+		@staticmethod
+		def decode(**kw):
+			return kw
+	return echo
+decode_adapters = [_echo(n) for n in set(a.clsname for a in server_adapters)-set(BaseCodec(loader=None).name2cls)]
+
+## Timing
+
+def wire_size(msg):
+	"""Number of bytes on the wire; None for the null codec"""
+	if isinstance(msg,WireMessage):
+		return len(msg.body)+sum(len(memoryview(b).tobytes()) for b in msg.buffers)
+	if isinstance(msg,dict):
+		return None
+	if not isinstance(msg,bytes):
+		msg = msg.encode('utf-8')
+	return len(msg)
+
+def measure(proc, make_arg, min_time):
+	"""\
+		Returns operations per second, and the memory allocated by one run.
+		The time to create the argument is not counted.
+		"""
+	n = 0
+	t = 0
+	while True:
+		arg = make_arg()
+		t1 = timer()
+		proc(arg)
+		t += timer()-t1
+		n += 1
+		if t >= min_time:
+			break
+	res = {'ops':n/t}
+	if tracemalloc is not None:
+		arg = make_arg()
+		tracemalloc.start()
+		r = proc(arg)
+		# bytes and blocks still used by the result, and the peak
+		res['alloc_bytes'],res['alloc_peak'] = tracemalloc.get_traced_memory()
+		res['alloc_blocks'] = sum(s.count for s in tracemalloc.take_snapshot().statistics('filename'))
+		tracemalloc.stop()
+		del r
+	return res
+
+def bench(name, payload, cfg, min_time):
+	enc = import_string("dabroker.base.codec."+name+".Codec")(loader=None, adapters=server_adapters, cfg=cfg)
+	dec = import_string("dabroker.base.codec."+name+".Codec")(loader=None, adapters=decode_adapters, cfg=cfg)
+	data,include = PAYLOADS[payload]()
+
+	msg = enc.encode(data, _include=include)
+	res = {'codec':name, 'payload':payload, 'bytes':wire_size(msg)}
+	res['encode'] = measure(lambda d: enc.encode(d, _include=include), lambda: data, min_time)
+	res['decode'] = measure(dec.decode, lambda: msg, min_time)
+	if name == "null":
+		# The message is not serialized, so decode2 modifies it.
+		get_msg = lambda: dec.decode(enc.encode(data, _include=include))
+	else:
+		get_msg = lambda: dec.decode(msg)
+	res['decode2'] = measure(dec.decode2, get_msg, min_time)
+	return res
+
+## Reporting
+
+OPS = ('encode','decode','decode2')
+
+def report(results, old=None, out=sys.stdout):
+	if old is not None:
+		old = dict(((r['codec'],r['payload']),r) for r in old['results'])
+	mem = tracemalloc is not None
+	head = "%-8s %-15s %9s %10s %10s %10s" % (("codec","payload","bytes")+OPS)
+	if mem:
+		head += "   peak kB: %6s %6s %6s" % OPS
+	print(head, file=out)
+	for r in results:
+		line = "%-8s %-15s %9s" % (r['codec'],r['payload'],"-" if r['bytes'] is None else r['bytes'])
+		o = old.get((r['codec'],r['payload']),None) if old else None
+		for op in OPS:
+			if o is None:
+				line += " %10.1f" % r[op]['ops']
+			else:
+				# faster than before: > 1
+				line += " %9.2fx" % (r[op]['ops']/o[op]['ops'])
+		if mem:
+			line += "            "+" ".join("%6d" % (r[op]['alloc_peak']//1024) for op in OPS)
+		print(line, file=out)
+
+def main(args=None):
+	p = ArgumentParser(description="Time DaBroker's codecs")
+	p.add_argument("-c","--codec", action="append", choices=CODECS, help="codec to test (default: all available)")
+	p.add_argument("-p","--payload", action="append", choices=sorted(PAYLOADS), help="payload to use (default: all)")
+	p.add_argument("-s","--set", action="append", default=[], metavar="NAME=VALUE", help="codec configuration, e.g. codec_compact=1")
+	p.add_argument("-t","--time", type=float, default=0.5, help="seconds to spend on each measurement")
+	p.add_argument("-o","--output", help="write the results to this file, as JSON")
+	p.add_argument("-C","--compare", help="show speed relative to this JSON file")
+	args = p.parse_args(args)
+
+	cfg = {}
+	for s in args.set:
+		k,v = s.split('=',1)
+		try:
+			v = json.loads(v)
+		except ValueError:
+			pass
+		cfg[k] = v
+	codecs = args.codec
+	if not codecs:
+		codecs = []
+		for name in CODECS:
+			try:
+				import_string("dabroker.base.codec."+name+".Codec")
+			except ImportError:
+				print("Codec %s is not available, skipped" % name, file=sys.stderr)
+			else:
+				codecs.append(name)
+
+	sys.setrecursionlimit(max(sys.getrecursionlimit(),10000))
+	results = []
+	for name in codecs:
+		for payload in (args.payload or sorted(PAYLOADS)):
+			results.append(bench(name,payload,cfg,args.time))
+
+	old = None
+	if args.compare:
+		with open(args.compare) as f:
+			old = json.load(f)
+	report(results, old)
+
+	if args.output:
+		res = {'version':".".join(str(x) for x in __VERSION__), 'python':sys.version.split()[0],
+			'implementation':sys.subversion[0] if hasattr(sys,'subversion') else sys.implementation.name,
+			'cfg':cfg, 'results':results}
+		with open(args.output,"w") as f:
+			json.dump(res,f, indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+	main()
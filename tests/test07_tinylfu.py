@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# Test the W-TinyLFU cache, by count and by memory use
+
+from dabroker.util.tests import test_init
+from dabroker.util.thread import AsyncResult
+from dabroker.client.service import CacheDict,TinyLFUCache,CacheStats, entry_size
+from dabroker.client.codec import CacheProxy
+
+from bisect import bisect
+from random import Random
+from time import time
+
+logger = test_init("test.07.tinylfu")
+
+class CacheItem(object):
+	def __init__(self,x):
+		self.x = x
+		self._obsolete = False
+	def _obsoleted(self):
+		pass
+
+SIZE=100
+d = TinyLFUCache(size=SIZE)
+
+# Items which are in use elsewhere stay available
+kept = [CacheItem(i) for i in range(0,SIZE*10,7)]
+for i in range(SIZE*10):
+	d[i] = kept[i//7] if i%7 == 0 else CacheItem(i)
+	if i:
+		d[1] # this one is popular
+assert d[1].x == 1
+assert d.get(SIZE*10-1) is not None
+assert len(d) <= SIZE+len(kept), len(d)
+for x in kept:
+	assert d[x.x] is x, x
+
+# Interim values are not pinned
+ar = d.set("ar",AsyncResult())
+assert d["ar"] is ar
+del ar
+assert d.get("ar") is None
+
+# Invalidation
+x = d[SIZE*10-1]
+d.invalidate(SIZE*10-1)
+assert x._obsolete
+assert d.get(SIZE*10-1) is None
+del x
+
+# Compare with CacheDict on a skewed workload
+N=SIZE*50
+rnd = Random(42)
+w = 0
+weights = []
+for i in range(N):
+	w += 1/(i+1)
+	weights.append(w)
+keys = [bisect(weights,rnd.random()*w) for _ in range(N*10)]
+
+def hit_rate(d):
+	hits = 0
+	t1 = time()
+	for k in keys:
+		if d.get(k) is None:
+			d[k] = CacheItem(k)
+		else:
+			hits += 1
+	t2 = time()
+	logger.info("%s: %.1f%% hits, %.2f sec", d.__class__.__name__,100*hits/len(keys),t2-t1)
+	return hits/len(keys)
+stats = CacheStats()
+d = CacheDict(size=SIZE*5)
+d.stats = stats
+fifo = hit_rate(d)
+assert stats.reset()[None]['cache']['evict'] > 0
+d = TinyLFUCache(size=SIZE*5)
+d.stats = stats
+lfu = hit_rate(d)
+assert lfu > fifo, (lfu,fifo)
+assert stats.reset()[None]['cache']['evict'] > 0
+
+# The most popular keys are at the front of the workload's distribution
+hot = d.hot(3)
+assert len(hot) == 3, hot
+assert hot[0][0].x < 5, hot
+
+# Limited by memory
+class Meta(object):
+	def __init__(self,name):
+		self.name = name
+big,small = Meta("big"),Meta("small")
+LIMIT=100000
+d = TinyLFUCache(size=SIZE, memory=LIMIT)
+for i in range(SIZE*10):
+	if i%10:
+		d[i] = CacheProxy("x"*100, small)
+	else:
+		d[i] = CacheProxy("x"*10000, big)
+u = d.usage()
+logger.info("usage: %r",u)
+assert u['big']['bytes'] > 10000*u['big']['count'], u
+assert u['big']['bytes']+u['small']['bytes'] <= LIMIT, u
+assert sum(entry_size(v) for k,v in d.pinned()) <= LIMIT
+
+# Entries which grow in place don't exceed any segment's budget
+def check_budget():
+	assert d.window.used <= d.window_size, (d.window.used,d.window_size)
+	assert d.protected.used <= d.protected_size, (d.protected.used,d.protected_size)
+	assert d.probation.used+d.protected.used <= d.main_size, (d.probation.used,d.protected.used,d.main_size)
+	assert sum(entry_size(v) for k,v in d.pinned()) <= LIMIT
+k = next(iter(d.probation))
+d[k] # promote
+for seg in (d.window,d.protected,d.probation):
+	k = next(iter(seg))
+	d[k] = CacheProxy("x"*20000, big)
+	check_budget()
+
+logger.debug("Exiting")
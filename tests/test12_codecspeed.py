@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test times the codec on a large (10k objects) reply, and verifies
+# that structures which are nested deeper than Python's recursion limit
+# can be transmitted.
+
+from dabroker.util.tests import test_init,test_cfg
+from dabroker.base.codec import BaseCodec,WireMessage,LazyValue,array_type
+from dabroker.base.transport.amqp import AmqpTransport
+from dabroker.util import import_string,TZ
+
+import amqp
+import sys
+import datetime as dt
+from array import array
+from time import time
+
+logger = test_init("test.12.codecspeed")
+
+N=10000
+codec = BaseCodec(loader=None)
+
+def amqp_wire(msg):
+	"""\
+		Send an AMQP message through py-amqp's encoding, as its frame
+		writer and a channel with `auto_decode` do.
+		"""
+	body = msg.body
+	if not isinstance(body,bytes):
+		body = body.encode(msg.properties.setdefault('content_encoding','utf-8'))
+	res = amqp.Message()
+	res._load_properties(res.CLASS_ID, msg._serialize_properties(), 0)
+	res.body = body
+	enc = res.properties.get('content_encoding',None)
+	if enc is not None:
+		try:
+			res.body = body.decode(enc)
+		except Exception:
+			pass
+	return res
+
+def make_reply(shared=True):
+	dept = {'dept':"Sales", 'floor':3}
+	res = []
+	for i in range(N):
+		if not shared:
+			dept = {'dept':"Sales", 'floor':3}
+		res.append({'id':i, 'name':"Person %d"%i, 'tags':["a","b",i], 'dept':dept,
+			'info':{'x':i*2, 'y':[i,{'z':i}]}, 'when':dt.date(2014,1,1+i%28)})
+	return res
+
+def check_reply(res, shared=True):
+	assert len(res) == N, len(res)
+	dept = res[0]['dept']
+	for i,r in enumerate(res):
+		assert r['id'] == i
+		assert r['tags'][2] == i
+		assert r['info']['y'][1]['z'] == i
+		assert (r['dept'] is dept) == (shared or not i), i
+		assert r['dept']['floor'] == 3
+		assert r['when'] == dt.date(2014,1,1+i%28)
+
+def timed(what,proc,*a):
+	t1 = time()
+	res = proc(*a)
+	t2 = time()
+	logger.info("%s: %.3f sec", what,t2-t1)
+	return res
+
+msg = make_reply()
+enc = timed("encode",codec.encode,msg)
+assert len(enc['cache']) == 1, enc['cache']
+enc = codec.decode(enc)
+dec = timed("decode",codec.decode2,enc)
+check_reply(dec)
+
+# Streaming decode
+enc = codec.decode(codec.encode(msg))
+dec = timed("decode iter",lambda e: list(codec.decode2_iter(e)),enc)
+check_reply(dec)
+
+# Tree-shaped data does not need the object cache
+msg = make_reply(shared=False)
+enc = timed("encode tree",codec.encode,msg)
+assert 'cache' not in enc, enc['cache']
+enc = codec.decode(enc)
+dec = timed("decode tree",codec.decode2,enc)
+check_reply(dec, shared=False)
+
+# Repeated dict shapes are sent once
+icodec = BaseCodec(loader=None, cfg={'codec_intern':True})
+for shared in (True,False):
+	msg = make_reply(shared=shared)
+	enc = timed("encode interned",icodec.encode,msg)
+	assert len(enc['shapes']) == (4 if shared else 5), enc['shapes']
+	enc = icodec.decode(enc)
+	dec = timed("decode interned",icodec.decode2,enc)
+	check_reply(dec, shared=shared)
+	enc = icodec.decode(icodec.encode(msg))
+	check_reply(list(icodec.decode2_iter(enc)), shared=shared)
+# … and non-interned messages can still be read
+dec = icodec.decode2(icodec.decode(codec.encode(msg)))
+check_reply(dec, shared=False)
+
+# Adapters are looked up once per type
+st = codec.type2cls.stats()
+assert st['misses'] == 1, st
+assert st['hits'] >= 2*N-1, st
+codec.register(codec.type2cls.get(dt.date))
+assert codec.type2cls.stats()['size'] == 0
+
+# Included objects share their meta object's key. That's immutable, so
+# the reply is still encoded in one pass.
+from dabroker.base import BrokeredInfo,Field,BaseObj,BaseRef
+from dabroker.server.codec import adapters as server_adapters
+thingMeta = BrokeredInfo("thing")
+thingMeta.add(Field("n"))
+thingMeta._key = BaseRef(key=("thing",))
+class Thing(BaseObj):
+	_meta = thingMeta
+	def __init__(self,n):
+		self.n = n
+		self._key = BaseRef(key=("thing",n))
+scodec = BaseCodec(loader=None, adapters=server_adapters)
+passes = []
+def counted(*a,**k):
+	passes.append(1)
+	return BaseCodec._encode(scodec,*a,**k)
+scodec._encode = counted
+enc = scodec.encode([Thing(i) for i in range(10)], _include=True)
+assert len(passes) == 1, passes
+assert 'cache' not in enc, enc
+assert enc['data']['_d'][9]['f']['n'] == 9, enc
+# … but shared mutable data still needs the full encoder.
+del passes[:]
+d = {'x':1}
+enc = scodec.encode([d,d])
+assert len(passes) == 2, passes
+
+# Large binary data is passed out-of-band
+blob = bytearray(b"x"*100000)
+msg = {'blob':blob, 'small':b"abc", 'view':memoryview(blob)[10:70010]}
+enc = codec.encode(msg)
+assert len(enc['buffers']) == 2, enc
+dec = codec.decode2(codec.decode(enc))
+assert dec['blob'] is blob
+assert dec['small'] == b"abc"
+
+# … also when framed for AMQP
+name = test_cfg['codec']
+if name != "null":
+	wcodec = import_string("dabroker.base.codec."+name+".Codec")(loader=None)
+	del msg['small'] # JSON can't do that
+	enc = wcodec.encode(msg)
+	assert isinstance(enc,WireMessage), enc
+	tr = AmqpTransport(callbacks=None,cfg={'codec':name})
+	enc = tr.decode_msg(tr.encode_msg(enc))
+	dec = wcodec.decode2(wcodec.decode(enc))
+	assert dec['blob'].tobytes() == bytes(blob)
+	assert dec['view'].tobytes() == bytes(blob[10:70010])
+
+	# Large messages are compressed, small ones are not
+	ccodec = import_string("dabroker.base.codec."+name+".Codec")(loader=None, cfg={'codec_compress':'zlib'})
+	msg = make_reply(shared=False)[:100]
+	enc = ccodec.encode(msg)
+	assert isinstance(enc,WireMessage) and enc.encoding == "zlib", enc
+	raw = wcodec.encode(msg)
+	logger.info("compressed: %d => %d bytes", len(raw),len(enc.body))
+	assert len(enc.body) < len(raw)
+	amsg = amqp_wire(tr.encode_msg(enc))
+	assert amsg.properties['application_headers']['x-dab-compress'] == "zlib"
+	assert 'content_encoding' not in amsg.properties
+	dec = wcodec.decode2(wcodec.decode(tr.decode_msg(amsg)))
+	assert [r['id'] for r in dec] == list(range(100)), dec
+	assert dec[99]['info']['y'][1]['z'] == 99
+	enc = ccodec.encode({'small':1})
+	assert not isinstance(enc,WireMessage), enc
+
+	# Uncompressed messages survive, even if py-amqp sets a charset
+	for c in (wcodec,ccodec):
+		enc = tr.decode_msg(amqp_wire(tr.encode_msg(c.encode({'small':1}))))
+		assert c.decode2(c.decode(enc)) == {'small':1}, enc
+
+# Lazy decoding
+class Row(object):
+	def __init__(self,f):
+		self.f = f
+class _row(object):
+	cls = Row
+	clsname = "Row"
+	lazy = ('f',)
+	@staticmethod
+	def encode(obj, include=False):
+		return {'f':obj.f}
+	@staticmethod
+	def decode(f):
+		return Row(f)
+
+lcodec = BaseCodec(loader=None, adapters=[_row], cfg={'codec_lazy':True})
+shared = {'x':1}
+when = dt.datetime(2014,7,4,12,34,56)
+dec = lcodec.decode2(lcodec.decode(lcodec.encode([Row({'n':1,'d':shared,'when':when,'l':[1,{'a':2}]}), shared])))
+f = dec[0].f
+assert f['n'] == 1, f
+assert isinstance(f['when'],LazyValue), f
+assert f['when'].get() == when.replace(tzinfo=TZ), f['when'].get()
+assert f['d'].get() is dec[1], (f['d'],dec[1])
+assert f['l'].get() == [1,{'a':2}], f['l']
+# decoding again returns the same values
+assert f['when'].get() == when.replace(tzinfo=TZ), f['when'].get()
+assert f['d'].get() is dec[1], (f['d'],dec[1])
+assert f['l'].get() == [1,{'a':2}], f['l']
+
+# Dates and times without human-readable strings
+dcodec = BaseCodec(loader=None, cfg={'codec_compact_dates':True})
+vals = [dt.datetime(2014,7,4,12,34,56,789), dt.date(2014,7,4), dt.time(12,34,56,789), dt.timedelta(1,2,3)]
+enc = dcodec.encode(vals)
+assert not any('s' in v for v in enc['data']['_d']), enc
+dec = codec.decode2(codec.decode(enc))
+assert dec[0] == vals[0].replace(tzinfo=TZ), dec[0]
+assert dec[1:] == vals[1:], dec
+
+# Arrays, as used for columnar search results
+arrs = {'i':array(array_type('q'),range(-5000,5000)), 'f':array(str('d'),(i/3 for i in range(1000)))}
+dec = codec.decode2(codec.decode(codec.encode(arrs)))
+assert dec == arrs, dec
+if name != "null":
+	dec = wcodec.decode2(wcodec.decode(wcodec.encode(arrs)))
+	assert dec == arrs, dec
+
+# Nesting deeper than the recursion limit
+depth = sys.getrecursionlimit()*2
+msg = top = {}
+for i in range(depth):
+	msg['n'] = [i,{}]
+	msg = msg['n'][1]
+enc = codec.encode(top)
+dec = codec.decode2(codec.decode(enc))
+for i in range(depth):
+	assert dec['n'][0] == i
+	dec = dec['n'][1]
+assert dec == {}, dec
+
+logger.debug("Exiting")
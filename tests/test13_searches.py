@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# Test the index which finds the searches a change affects
+
+from dabroker.util.tests import test_init
+from dabroker.client.codec import SearchDict, search_key
+
+import gc
+from random import Random
+from time import time
+
+logger = test_init("test.13.searches")
+
+class Search(object):
+	def __init__(self,kw):
+		self.kw = kw
+
+def affected(searches, k):
+	"""The obvious way: check every search"""
+	res = set()
+	is_update = any(len(v) > 1 for v in k.values())
+	for ks,s in searches.items():
+		common = [i for i in k if i in s.kw]
+		if common:
+			if all(s.kw[i] in k[i] for i in common):
+				res.add(ks)
+		elif not is_update:
+			res.add(ks)
+	return res
+
+FIELDS = ("w","x","y","z")
+rnd = Random(42)
+d = SearchDict()
+kept = []
+for i in range(2000):
+	kw = dict((f,rnd.randrange(10)) for f in FIELDS if rnd.random() < 0.4)
+	if rnd.random() < 0.05:
+		kw["y"] = [1,2] # unhashable
+	kw['_obj'] = None # not indexed
+	s = Search(kw)
+	kept.append(s)
+	d[search_key(None,**kw)] = s
+assert len(d) > 100, len(d)
+
+def changes(n):
+	for i in range(n):
+		fields = rnd.sample(FIELDS,rnd.randrange(1,3))
+		if rnd.random() < 0.3: # new or deleted object
+			yield dict((f,(rnd.randrange(10),)) for f in FIELDS)
+		else:
+			yield dict((f,(rnd.randrange(10),rnd.randrange(10))) for f in fields)
+
+t_old = t_new = 0
+for k in changes(500):
+	t1 = time()
+	old = affected(d,k)
+	t2 = time()
+	new = d.affected(k)
+	t3 = time()
+	assert set(new) == old, (k,set(new)^old)
+	assert len(new) == len(old)
+	t_old += t2-t1
+	t_new += t3-t2
+logger.info("scan: %.3f sec, index: %.3f sec", t_old,t_new)
+
+# Unhashable values in the change
+k = {"y":([1,2],[3])}
+assert set(d.affected(k)) == affected(d,k)
+
+# Removed searches are dropped from the index
+ks = search_key(None,**kept[0].kw)
+d.pop(ks)
+assert ks not in d.entries
+del kept[:],s
+gc.collect()
+assert len(d) == 0, len(d)
+assert not d.entries, d.entries
+assert not d.shapes and not d.values and not d.loose
+
+logger.debug("Exiting")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that narrower searches, and counts, are answered from
+# cached broader searches.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Field,Ref, BaseObj
+from dabroker.server import export_class
+from dabroker.server.loader import BaseLoader
+from dabroker.util import cached_property,exported_classmethod
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+logger = test_init("test.14.contained")
+
+class Person(BaseObj):
+	_dab_cached=True
+	objs = {}
+
+	def __init__(self,name,dept,active,boss=None):
+		self.name = name
+		self.dept = dept
+		self.active = active
+		self.boss = boss
+
+	@classmethod
+	def _find(cls,**kw):
+		res = []
+		for k,obj in sorted(cls.objs.items()):
+			for k,v in kw.items():
+				if getattr(obj,k,None) != v:
+					break
+			else:
+				res.append(obj)
+		return res
+
+	@exported_classmethod
+	def _dab_search(cls,_limit=None,**kw):
+		return cls._find(**kw)
+
+	@exported_classmethod
+	def _dab_count(cls,**kw):
+		return len(cls._find(**kw))
+
+class Desk(BaseObj):
+	"""Searches for desks return references, not objects"""
+	_dab_cached=True
+	objs = {}
+
+	def __init__(self,floor,room):
+		self.floor = floor
+		self.room = room
+
+	@exported_classmethod(include=False)
+	def _dab_search(cls,_limit=None,**kw):
+		res = []
+		for k,obj in sorted(cls.objs.items()):
+			for k,v in kw.items():
+				if getattr(obj,k,None) != v:
+					break
+			else:
+				res.append(obj)
+		return res
+
+class DeskLoader(BaseLoader):
+	id = "desk"
+
+	def get(self,*key):
+		return Desk.objs[key]
+
+	def add(self,obj,*key):
+		self.set_key(obj,*key)
+		Desk.objs[key] = obj
+
+class PersonLoader(BaseLoader):
+	id = "person"
+
+	def get(self,*key):
+		return Person.objs[key]
+
+	def add(self,obj,*key):
+		self.set_key(obj,*key)
+		Person.objs[key] = obj
+
+class Test14_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Ref("persons"))
+		rootMeta.add(Ref("desks"))
+		self.add_static(rootMeta,0,1)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+
+		self.persons = PersonLoader(self.loader)
+		exp = export_class(Person,self.loader, attrs="+")
+		exp.add(Field('name'))
+		exp.add(Field('dept'))
+		exp.add(Field('active'))
+		exp.add(Ref('boss'))
+
+		boss = None
+		for i in range(10):
+			p = Person("p%d"%i, 5 if i < 6 else 6, i%2 == 0, boss)
+			self.persons.add(p,i)
+			if i == 0:
+				boss = p
+
+		self.desks = DeskLoader(self.loader)
+		dexp = export_class(Desk,self.loader, attrs="+")
+		dexp.add(Field('floor'))
+		dexp.add(Field('room'))
+		for i in range(8):
+			self.desks.add(Desk(i//4,i%2),i)
+
+		root = RootObj()
+		root.persons = exp
+		root.desks = dexp
+		self.add_static(root,0,2,14)
+		return root
+
+	def do_retire(self, i):
+		p = Person.objs[(i,)]
+		p.active = False
+		self.send_updated(p, {'active':(True,False)})
+
+done=0
+
+class Test14_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def main(self):
+		with self.env:
+			root = self.root
+			P = root.persons
+
+			cid = self.cid
+			dept = list(P.find(dept=5))
+			assert len(dept) == 6, dept
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# Narrower searches and counts don't need the server
+			act = list(P.find(dept=5, active=True))
+			assert sorted(p.name for p in act) == ["p0","p2","p4"], act
+			assert all(p in dept for p in act)
+			assert P.count(dept=5, active=False) == 3
+			assert P.count(dept=5) == 6
+			boss = P.get(dept=5,name="p0")
+			assert boss is dept[0], boss
+			assert len(list(P.find(dept=5, boss=boss))) == 5
+			assert self.cid == cid+1, (cid,self.cid)
+			assert P.count(dept=5, boss=None) == 1
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# … but others do
+			assert len(list(P.find(dept=6, active=True))) == 2
+			assert self.cid == cid+2, (cid,self.cid)
+			assert len(list(P.find(dept=5, unknown=True))) == 0
+			assert self.cid == cid+3, (cid,self.cid)
+
+			# An update drops the narrower search, but not the broader one;
+			# the changed object is refreshed.
+			self.send("retire",2)
+			cid = self.cid
+			act = list(P.find(dept=5, active=True))
+			assert sorted(p.name for p in act) == ["p0","p4"], act
+			assert self.cid == cid+1, (cid,self.cid)
+			assert P.count(dept=5, active=False) == 4
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# Searches which return references are used if the objects
+			# are cached …
+			D = root.desks
+			cid = self.cid
+			assert len(list(D.find(floor=0))) == 4
+			c = self.cid
+			res = list(D.find(floor=0, room=1))
+			assert len(res) == 2 and all(d.room == 1 for d in res), res
+			assert self.cid == c, (c,self.cid)
+
+			# … but not if they'd have to be fetched.
+			self.find(D, _cached=True, floor=1)
+			c = self.cid
+			res = list(D.find(floor=1, room=0))
+			assert len(res) == 2 and all(d.floor == 1 for d in res), res
+			assert self.cid == c+3, (c,self.cid) # the search, and two objects
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test14_client
+	server_factory = Test14_server
+
+t = Tester()
+t.register_stop(logger.debug,"shutting down")
+t.run()
+
+assert done==1, done
+
+logger.debug("Exiting")
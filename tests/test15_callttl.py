@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that cached call results expire, and that stale results
+# are returned while they're refreshed in the background.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Callable, BaseObj
+from dabroker.util import cached_property,exported
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+from time import sleep
+
+logger = test_init("test.15.callttl")
+
+TTL=0.3
+
+class Test15_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Callable("tick", ttl=TTL, stale=60))
+		rootMeta.add(Callable("tock", cached=True, ttl=TTL))
+		self.add_static(rootMeta,0,1)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+			ticks = 0
+			tocks = 0
+			@exported
+			def tick(self):
+				self.ticks += 1
+				return self.ticks
+			@exported
+			def tock(self):
+				self.tocks += 1
+				return self.tocks
+
+		root = RootObj()
+		self.add_static(root,0,2,15)
+		return root
+
+done=0
+
+class Test15_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def main(self):
+		with self.env:
+			root = self.root
+
+			cid = self.cid
+			assert root.tick() == 1
+			assert root.tick() == 1
+			assert root.tock() == 1
+			assert root.tock() == 1
+			assert self.cid == cid+2, (cid,self.cid)
+			self.cache_stats(reset=True)
+
+			# Stale results are returned, and refreshed in the background
+			sleep(TTL*1.5)
+			cid = self.cid
+			assert root.tick() == 1
+			assert root.tick() == 1
+			for i in range(100):
+				if self.cid != cid:
+					break
+				sleep(0.01)
+			assert self.cid == cid+1, (cid,self.cid)
+			assert root.tick() == 2
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# Without `stale`, an expired result is fetched again
+			assert root.tock() == 2
+			assert self.cid == cid+2, (cid,self.cid)
+			assert root.tock() == 2
+			assert self.cid == cid+2, (cid,self.cid)
+
+			st = self.cache_stats()['rootMeta']['call']
+			assert st == {'stale':2, 'hit':2, 'miss':1}, st
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test15_client
+	server_factory = Test15_server
+
+t = Tester()
+t.register_stop(logger.debug,"shutting down")
+t.run()
+
+assert done==1, done
+
+logger.debug("Exiting")
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that clients fetch the server's hot set when they start,
+# and when it grows.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Field,Ref, BaseObj
+from dabroker.util import cached_property
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+from time import sleep
+
+logger = test_init("test.16.hot")
+
+class Test16_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Ref("one"))
+		rootMeta.add(Ref("two"))
+		rootMeta.add(Ref("three"))
+		self.add_static(rootMeta,0,1)
+
+		valMeta = BrokeredInfo("valMeta")
+		valMeta.add(Field("val"))
+		self.add_static(valMeta,0,2)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+
+		class ValObj(BaseObj):
+			_meta = valMeta
+			def __init__(self,val):
+				self.val = val
+		self.ValObj = ValObj
+
+		root = RootObj()
+		self.add_static(root,0,3,16)
+		for i,n in ((1,"one"),(2,"two"),(3,"three")):
+			o = ValObj(i)
+			self.add_static(o,0,10,i)
+			setattr(root,n,o)
+		self.add_hot(root.one,root.two)
+		return root
+
+	def do_trigger(self):
+		"""Add a new object to the hot set, and return a reference to it"""
+		o = self.ValObj(4)
+		self.add_static(o,0,10,4)
+		self.add_hot(o)
+		return o._key
+
+done=0
+
+class Test16_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def main(self):
+		with self.env:
+			root = self.root
+
+			# The hot objects (and their metadata) are already here
+			cid = self.cid
+			assert root.one.val == 1
+			assert root.two.val == 2
+			assert self.cid == cid, (cid,self.cid)
+			assert root.three.val == 3
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# A new hot object is fetched without asking
+			cid = self.cid
+			ref = self.send("trigger")
+			for i in range(100):
+				if ref in self._cache:
+					break
+				sleep(0.01)
+			assert self.cid == cid+2, (cid,self.cid)
+			assert ref().val == 4
+			assert self.cid == cid+2, (cid,self.cid)
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test16_client
+	server_factory = Test16_server
+
+t = Tester(cfg={'hot':True})
+t.register_stop(logger.debug,"shutting down")
+t.run()
+
+assert done==1, done
+
+logger.debug("Exiting")
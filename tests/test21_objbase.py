@@ -211,6 +211,27 @@ class Test21_client(TestClient):
 			assert len(os) == 0, os
 			os = list(Op.find(hell="Two2"))
 			assert len(os) == 1, os
+			o2 = os[0]
+
+			# Columnar results
+			os = self.find(Op, _columns=True)
+			assert len(os) == 4, os
+			assert list(os.columns['hell']) == ["Zero","One","Two2","Three"], os.columns
+			assert os[2] == o1, (os[2],o1)
+			# objects we already have are updated, not replaced
+			assert os[2] is o2, (os[2],o2)
+
+			u = self.cache_usage()
+			assert u[Op.name]['count'] >= 4, u
+			st = self.cache_stats(reset=True)
+			assert st[Op.name]['find']['hit'] >= 1, st
+			assert st[Op.name]['find']['invalid'] >= 1, st
+			assert st[Op.name]['get']['miss'] >= 1, st
+			assert not self.cache_stats()
+			hot = self.cache_hot(3)
+			assert len(hot) == 3, hot
+			assert hot[0][1] >= hot[1][1] >= hot[2][1], hot
+			assert [o.hell for o in os[1:3]] == ["One","Two2"]
 
 			global done
 			done = 1
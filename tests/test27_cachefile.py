@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that the client's cache survives a restart, and that
+# stale objects are refreshed in a single round trip.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Field,Ref, BaseObj
+from dabroker.client.codec import client_broker_info_meta
+from dabroker.client.persist import CacheFile
+from dabroker.util import cached_property
+from dabroker.util.thread import Event
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+import os
+from datetime import datetime,timedelta
+from tempfile import mkstemp
+
+logger = test_init("test.27.cachefile")
+
+WHEN = datetime(2014,7,4,1,2,3)
+
+class Test27_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Field("hello"))
+		rootMeta.add(Ref("one"))
+		rootMeta.add(Ref("two"))
+		rootMeta.add(Ref("three"))
+		self.add_static(rootMeta,0,1)
+
+		valMeta = BrokeredInfo("valMeta")
+		valMeta.add(Field("val"))
+		valMeta.add(Field("when"))
+		self.add_static(valMeta,0,2)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+			hello = "Hello!"
+
+		class ValObj(BaseObj):
+			_meta = valMeta
+			def __init__(self,val):
+				self.val = val
+				self.when = WHEN+timedelta(val)
+
+		root = RootObj()
+		self.add_static(root,0,3,27)
+		for i,n in ((1,"one"),(2,"two"),(3,"three")):
+			o = ValObj(i)
+			self.add_static(o,0,10,i)
+			setattr(root,n,o)
+		return root
+
+	def do_trigger(self,msg):
+		root = self.root
+		if msg == 1:
+			root.two.val = 22
+			self.send_updated(root.two, {'val':(2,22)})
+		elif msg == 2:
+			three,root.three = root.three,None
+			self.loader.delete(three)
+			self.send("invalid", root._key,three._key, _include=None)
+		else:
+			raise RuntimeError(msg)
+		self.send("go_on")
+
+done=0
+
+class Test27_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def do_go_on(self):
+		self.go_on.set()
+
+	def trigger(self,msg):
+		self.go_on.clear()
+		self.send("trigger",msg)
+		self.go_on.wait()
+
+	def restart(self):
+		"""Forget all cached objects and load them from the file."""
+		self._cache = self.make_cache()
+		self._cache.stats = self.stats
+		self._add_to_cache(client_broker_info_meta)
+		self.root_key = None
+		cid = self.cid
+		self.load_cache()
+		assert self.cid == cid+1, (cid,self.cid)
+
+	def main(self):
+		with self.env:
+			self.go_on = Event()
+			assert self.epoch is not None
+
+			root = self.root
+			assert root.hello == "Hello!"
+			assert root.one.val == 1
+			assert root.two.val == 2
+			assert root.three.val == 3
+
+			# Saving leaves unread (lazy) fields intact
+			for i in range(2):
+				self.save_cache()
+				assert root.one.when.replace(tzinfo=None) == WHEN+timedelta(1), root.one.when
+				assert root.two.when.replace(tzinfo=None) == WHEN+timedelta(2), root.two.when
+			self.trigger(1)
+			assert root.two.val == 22
+			old_root = root
+			del root
+
+			# Unchanged objects are loaded from the file,
+			# the changed one is part of the check's reply.
+			self.restart()
+			cid = self.cid
+			root = self.root
+			assert root is not old_root
+			assert root.one.val == 1
+			assert root.two.val == 22, root.two.val
+			assert root.three.val == 3
+			assert root.three.when.replace(tzinfo=None) == WHEN+timedelta(3), root.three.when
+			assert cid == self.cid, (cid,self.cid)
+
+			# A restarted server has a new epoch, so everything is sent.
+			self.save_cache()
+			t.server.epoch = "restarted"
+			self.restart()
+			cid = self.cid
+			root = self.root
+			assert root.one.val == 1
+			assert root.two.val == 22
+			assert cid == self.cid, (cid,self.cid)
+
+			# Deleted objects are dropped.
+			self.save_cache()
+			self.trigger(2)
+			self.restart()
+			cid = self.cid
+			root = self.root
+			assert root.three is None
+			assert root.one.val == 1
+			assert cid == self.cid, (cid,self.cid)
+			assert root.hello == "Hello!"
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test27_client
+	server_factory = Test27_server
+
+fd,cache_file = mkstemp(suffix=".db")
+os.close(fd)
+try:
+	t = Tester(cfg={'cache_file':cache_file, 'codec_lazy':True})
+	t.register_stop(logger.debug,"shutting down")
+	t.run()
+
+	assert done==1, done
+
+	# stop() has saved the cache
+	cf = CacheFile(cache_file)
+	assert cf.info()['epoch'] == "restarted", cf.info()
+	assert len(list(cf.load())) >= 4
+	cf.close()
+finally:
+	os.unlink(cache_file)
+
+logger.debug("Exiting")
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that a client can fetch the root and all meta objects
+# with a single call.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Field,Ref, BaseObj
+from dabroker.server import export_class
+from dabroker.util import cached_property,exported
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+logger = test_init("test.28.bootstrap")
+
+class Test28_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Field("hello"))
+		rootMeta.add(Ref("ops"))
+		rootMeta.add(Ref("val"))
+		self.add_static(rootMeta,0,1)
+
+		valMeta = BrokeredInfo("valMeta")
+		valMeta.add(Field("val"))
+		self.add_static(valMeta,0,2)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+			hello = "Hello!"
+
+		class ValObj(BaseObj):
+			_meta = valMeta
+			val = 42
+
+		class OpsObj(BaseObj):
+			@exported
+			def rev(self,s):
+				return s[::-1]
+
+		export_class(OpsObj,self.loader, attrs="+")
+
+		root = RootObj()
+		self.add_static(root,0,3,28)
+		root.ops = OpsObj()
+		self.add_static(root.ops,0,4)
+		root.val = ValObj()
+		self.add_static(root.val,0,5)
+		return root
+
+done=0
+
+class Test28_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def main(self):
+		with self.env:
+			assert self.cid == 1, self.cid
+			root = self.root
+			assert root.hello == "Hello!"
+			assert root._meta.name == "rootMeta"
+			assert self.cid == 1, self.cid
+
+			# Only the objects themselves need to be fetched
+			assert root.val.val == 42
+			assert root.val._meta.name == "valMeta"
+			assert self.cid == 2, self.cid
+			assert root.ops.rev("abc") == "cba"
+			assert self.cid == 4, self.cid
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test28_client
+	server_factory = Test28_server
+
+t = Tester(cfg={'bootstrap':True})
+t.register_stop(logger.debug,"shutting down")
+t.run()
+
+assert done==1, done
+
+logger.debug("Exiting")
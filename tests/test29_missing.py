@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, division, unicode_literals
+##
+## This file is part of DaBroker, a distributed data access manager.
+##
+## DaBroker is Copyright © 2014 by Matthias Urlichs <matthias@urlichs.de>,
+## it is licensed under the GPLv3. See the file `README.rst` for details,
+## including optimistic statements by the author.
+##
+## This paragraph is auto-generated and may self-destruct at any time,
+## courtesy of "make update". The original is in ‘utils/_boilerplate.py’.
+## Thus, please do not remove the next line, or insert any blank lines.
+##BP
+
+# This test checks that the client remembers objects and search results
+# which don't exist, until they are created.
+
+from dabroker import patch; patch()
+from dabroker.base import BrokeredInfo, Field,Ref, BaseObj,BaseRef, NoData
+from dabroker.server import export_class
+from dabroker.server.loader import BaseLoader
+from dabroker.util import cached_property,exported_classmethod
+
+from dabroker.util.tests import test_init,TestMain,TestClient,TestServer
+
+logger = test_init("test.29.missing")
+
+class Thing(BaseObj):
+	_dab_cached=True
+	objs = {}
+
+	def __init__(self,name):
+		self.name = name
+
+	@exported_classmethod
+	def _dab_search(cls,_limit=None,**kw):
+		res = []
+		for obj in cls.objs.values():
+			for k,v in kw.items():
+				if getattr(obj,k,None) != v:
+					break
+			else:
+				res.append(obj)
+		return res
+
+class ThingLoader(BaseLoader):
+	"""Serves Things. Like an SQL table, it raises NoData if there's none."""
+	id = "thing"
+
+	def get(self,*key):
+		try:
+			return Thing.objs[key]
+		except KeyError:
+			raise NoData(key=key)
+
+	def add(self,obj,*key):
+		self.set_key(obj,*key)
+		Thing.objs[key] = obj
+
+class Test29_server(TestServer):
+	@cached_property
+	def root(self):
+		rootMeta = BrokeredInfo("rootMeta")
+		rootMeta.add(Ref("things"))
+		self.add_static(rootMeta,0,1)
+
+		class RootObj(BaseObj):
+			_meta = rootMeta
+
+		self.things = ThingLoader(self.loader)
+		exp = export_class(Thing,self.loader, attrs="+")
+		exp.add(Field('name'))
+
+		root = RootObj()
+		root.things = exp
+		self.add_static(root,0,2,29)
+		return root
+
+	def do_probe(self, i):
+		"""A reference to a Thing which may not exist"""
+		return BaseRef(key=(self.things.id,i))
+
+	def do_create(self, i,name):
+		obj = Thing(name)
+		self.things.add(obj,i)
+		self.send_created(obj, {'name':name})
+
+done=0
+
+class Test29_client(TestClient):
+	@property
+	def cid(self):
+		return self.transport.last_msgid
+
+	def main(self):
+		with self.env:
+			root = self.root
+			T = root.things
+
+			# Empty search results
+			cid = self.cid
+			assert list(T.find(name="seven")) == []
+			assert self.cid == cid+1, (cid,self.cid)
+			assert list(T.find(name="seven")) == []
+			assert self.cid == cid+1, (cid,self.cid)
+
+			# Missing objects
+			ref = self.send("probe",7)
+			cid = self.cid
+			for i in range(3):
+				try:
+					ref()
+				except NoData:
+					pass
+				else:
+					assert False, "found it?"
+			assert self.cid == cid+1, (cid,self.cid)
+			st = self.cache_stats()
+			assert st[None]['get'] == {'miss':1,'hit':2}, st
+
+			# If the reference knows its class, that's where they're counted
+			ref8 = self.send("probe",8)
+			ref8.meta = T
+			for i in range(2):
+				try:
+					ref8()
+				except NoData:
+					pass
+				else:
+					assert False, "found it?"
+			st = self.cache_stats()
+			assert st[T.name]['get'] == {'miss':1,'hit':1}, st
+			assert st[None]['get'] == {'miss':1,'hit':2}, st
+
+			# Creating the object invalidates both
+			self.send("create",7,"seven")
+			cid = self.cid
+			assert ref().name == "seven"
+			res = list(T.find(name="seven"))
+			assert len(res) == 1 and res[0] is ref(), res
+			assert self.cid == cid+2, (cid,self.cid)
+
+			global done
+			done = 1
+
+class Tester(TestMain):
+	client_factory = Test29_client
+	server_factory = Test29_server
+
+t = Tester()
+t.register_stop(logger.debug,"shutting down")
+t.run()
+
+assert done==1, done
+
+logger.debug("Exiting")